@@ -26,9 +26,11 @@
 import argparse
 import os
 import datetime
+import signal
 
 from gloria_deps import infile
 from gloria_deps import search
+from gloria_deps import trace
 from gloria_deps.gui import graph
 
 version =  "0.3"
@@ -58,6 +60,22 @@ parser.add_argument('-g', '--gamma', dest = 'gamma', metavar = '<#>', default =
 
 parser.add_argument('-m', '--max_combinations', dest = 'maxCombinations', metavar = '<#>', default = None, action = 'store', type = int, help = 'Maximum number of field combinations allowed per model optimization stage. Default = None.')
 
+parser.add_argument('--time-limit', dest = 'timeLimit', metavar = '<#>', default = None, action = 'store', type = float, help = 'Maximum search time in seconds. The best result found so far is reported when it expires (or if the run is interrupted). Default = None.')
+
+parser.add_argument('-j', '--jobs', dest = 'jobs', metavar = '<#>', default = 1, action = 'store', type = int, help = 'Number of processes evaluating field combinations. Default = 1.')
+
+parser.add_argument('--strategy', dest = 'strategy', metavar = 'exhaustive|beam|anneal', default = 'exhaustive', action = 'store', type = str, help = 'Search strategy for field combinations (`exhaustive`, `beam` or `anneal`). Default = `exhaustive`.')
+
+parser.add_argument('--beam-width', dest = 'beamWidth', metavar = '<#>', default = 10, action = 'store', type = int, help = 'Partial solutions kept per cycle by the beam search strategy. Default = 10.')
+
+parser.add_argument('--anneal-steps', dest = 'annealSteps', metavar = '<#>', default = 1000, action = 'store', type = int, help = 'Combinations evaluated per cycle by the simulated annealing strategy. Default = 1000.')
+
+parser.add_argument('--seed', dest = 'seed', metavar = '<#>', default = None, action = 'store', type = int, help = 'Seed of the random number generator used by the simulated annealing strategy. Default = None.')
+
+parser.add_argument('--narrow', action = 'store_true', dest = 'narrow', default = False, help = 'Store distributions and fields in narrow types (bytes and single precision floats), which takes about a fourth of the memory. Results may differ from the default double precision in the last digits.')
+
+parser.add_argument('--trace', dest = 'trace', metavar = '<trace_file>', default = None, action = 'store', help = 'Write a timeline of the analysis phases to a trace-event JSON file (can be opened in chrome://tracing or Perfetto).')
+
 parser.add_argument('-d', '--debbug', action = 'store_true', dest = 'debbug', default = False, help = 'Executes developper\'s version.')
 
 parser.add_argument('-v', '--version', action = 'version', version = "Gloria v. {0}".format(version))
@@ -88,6 +106,26 @@ if args.latOffset < 0:
 	print "\Argument error '-y'.\n\n{0} is not a valid latitudinal offset value (should be a float or integer greater than zero).\n".format(args.latOffset)
 	argPass = False
 
+if args.strategy != "exhaustive" and args.strategy != "beam" and args.strategy != "anneal":
+	print "\nArgument error '--strategy'.\n\n{0} is not a valid search strategy (should be `exhaustive`, `beam` or `anneal`).\n".format(args.strategy)
+	argPass = False
+
+if args.beamWidth < 1:
+	print "\nArgument error '--beam-width'.\n\n{0} is not a valid beam width (should be an integer greater than zero).\n".format(args.beamWidth)
+	argPass = False
+
+if args.annealSteps < 1:
+	print "\nArgument error '--anneal-steps'.\n\n{0} is not a valid number of steps (should be an integer greater than zero).\n".format(args.annealSteps)
+	argPass = False
+
+if args.timeLimit is not None and args.timeLimit < 0:
+	print "\nArgument error '--time-limit'.\n\n{0} is not a valid time limit (should be a positive number of seconds).\n".format(args.timeLimit)
+	argPass = False
+
+if args.jobs < 1:
+	print "\nArgument error '-j'.\n\n{0} is not a valid number of processes (should be an integer greater than zero).\n".format(args.jobs)
+	argPass = False
+
 if argPass:
 
 	if args.outfileRoot:
@@ -98,22 +136,50 @@ if argPass:
 		args.outfileRoot = outfileRootDefault
 
 	logfile = "{0}.log".format(args.outfileRoot)
-	indata = infile.InputData(infile = args.infile)
+	if args.trace:
+		trace.start()
+
+	with trace.span("InputData.__init__", infile = args.infile):
+		indata = infile.InputData(infile = args.infile)
 	totTaxa, uniqPoints = indata.getStats()
 	bufferLog += "Input data\nInfile: {0}\nTotal taxa processed: {1}\nUnique taxon-point pairs: {2}\n\n".format(args.infile, totTaxa, uniqPoints)
 
-	bufferLog += "Grid parameters\nCell size: {0} degrees\nCell shape: {1}\nLongitudinal W offset: {2}\nLatitudinal N offset: {3}\n\nAnalysis parameters\nClustering cohesion value: {4}\nPotts model gamma: {5}\nMaximum combinations by optimization cycle: {6}\n".format(args.cellSize, args.cellType, args.lonOffset, args.latOffset, args.cohesion, args.gamma, args.maxCombinations)
+	bufferLog += "Grid parameters\nCell size: {0} degrees\nCell shape: {1}\nLongitudinal W offset: {2}\nLatitudinal N offset: {3}\n\nAnalysis parameters\nClustering cohesion value: {4}\nPotts model gamma: {5}\nMaximum combinations by optimization cycle: {6}\nSearch strategy: {8}\nBeam width: {9}\nAnnealing steps: {11}\nRandom seed: {12}\nTime limit: {10}\nProcesses: {7}\nNarrow storage: {13}\n".format(args.cellSize, args.cellType, args.lonOffset, args.latOffset, args.cohesion, args.gamma, args.maxCombinations, args.jobs, args.strategy, args.beamWidth, args.timeLimit, args.annealSteps, args.seed, args.narrow)
 
-	myTiles = indata.getTiles(cellSize = args.cellSize, geometry = args.cellType, offsetLat = args.latOffset, offsetLon = args.lonOffset)
+	with trace.span("getTiles", cellSize = args.cellSize, geometry = args.cellType) as sp:
+		myTiles = indata.getTiles(cellSize = args.cellSize, geometry = args.cellType, offsetLat = args.latOffset, offsetLon = args.lonOffset, narrow = args.narrow)
+		sp.set(tiles = len(myTiles))
 
 	if args.cellType == "square":
 		bufferLog += "Effective NW corner: {0}, {1}\n\n".format(indata.originN[0], indata.originN[1])
 	elif args.cellType == "hexagon":
 		pass
 
-	result = search.fieldOptim(observations = myTiles, clusCohesion = args.cohesion, maxCycleIters = args.maxCombinations, gammaParameter = args.gamma, progress2stdout = True, debbug = args.debbug)
+	# SIGTERM stops the search as Ctrl-C does, outputs are still written. The
+	# previous handler is restored before writing, so a late SIGTERM cannot
+	# interrupt a file halfway.
+	def terminate(signum, frame):
+		raise KeyboardInterrupt
+	prevHandler = signal.signal(signal.SIGTERM, terminate)
+
+	try:
+		with trace.span("fieldOptim"):
+			result = search.fieldOptim(observations = myTiles, clusCohesion = args.cohesion, maxCycleIters = args.maxCombinations, gammaParameter = args.gamma, progress2stdout = True, workers = args.jobs, strategy = args.strategy, beamWidth = args.beamWidth, annealSteps = args.annealSteps, randomSeed = args.seed, timeLimit = args.timeLimit, debbug = args.debbug)
+	finally:
+		signal.signal(signal.SIGTERM, prevHandler)
 	bufferLog += "Results\n{0} Areas of Endemism found.\nPseudolikelihood of the prefered hypothesis: {1}\nPseudolikelihood Information Criterion (PLIC) value: {2}\nAkaike Information Criterion (AIC) value: {3}\n\n".format(result.components, result.pseudolikelihood, result.plic, result.aic)
 
+	if result.truncated:
+		bufferLog += "Warning: search was truncated (time limit or interruption), results are the best found so far.\n\n"
+
+	bufferLog += "Combinations evaluated per cycle\n"
+	for cycle in result.cycles:
+		bufferLog += "{0} areas: {1}\n".format(cycle["components"], cycle["evaluated"])
+	bufferLog += "\n"
+
+	if result.cacheStats:
+		bufferLog += "Fitted field cache: {0} hits, {1} misses, {2} evictions\n\n".format(result.cacheStats["hits"], result.cacheStats["misses"], result.cacheStats["evictions"])
+
 	for indaoe, aoe in enumerate(result.field2taxa):
 		bufferLog += "=" * 20
 		bufferLog += "\n\nArea {0}\n\n{1}\nPosterior probabilities on area membership:\n\n".format((indaoe + 1), aoe)
@@ -127,11 +193,12 @@ if argPass:
 		bufferLog += "\n"
 
 	# Output geojson file
-	basegrid = graph.Grid(indata.rows, indata.cols, indata.cellSize, indata.geometry, indata.originN, indata.originS)
-	os.makedirs("{0}_areas_geojson_files".format(args.outfileRoot))
-	with open("{0}_basegrid.geojson".format(args.outfileRoot), "w") as bfile:
-		bfile.write(basegrid.geojson())
-	basegrid.res2geojson(result, "{0}_areas_geojson_files".format(args.outfileRoot))
+	with trace.span("geojson"):
+		basegrid = graph.Grid(indata.rows, indata.cols, indata.cellSize, indata.geometry, indata.originN, indata.originS)
+		os.makedirs("{0}_areas_geojson_files".format(args.outfileRoot))
+		with open("{0}_basegrid.geojson".format(args.outfileRoot), "w") as bfile:
+			bfile.write(basegrid.geojson())
+		basegrid.res2geojson(result, "{0}_areas_geojson_files".format(args.outfileRoot))
 
 	now = datetime.datetime.now()
 	timeDiff = now - today
@@ -140,4 +207,7 @@ if argPass:
 	with open(logfile, "w") as loghandle:
 		loghandle.write(bufferLog)
 
+	if args.trace:
+		trace.write(args.trace)
+
 exit()
@@ -0,0 +1,293 @@
+###############################################################################
+#
+#	Copyright 2016-2017 Nelson R. Salinas
+#
+#
+#	This file is part of Gloria.
+#
+#   Gloria is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+#	Gloria is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with Gloria.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+# Benchmarks of the main routines of Gloria on simulated datasets. Each case
+# runs in its own process, so peak memory can be measured independently of
+# other cases. Run `python -m gloria_deps.bench -h` for the command line.
+
+import datetime
+import json
+import os
+import platform
+import resource
+import numpy
+from multiprocessing import Process, Pipe
+from timeit import default_timer
+from .. import data
+from .. import search
+from .. import sim
+
+class Dataset(object):
+	"""
+	Specification of a simulated dataset.
+
+	Arguments:
+
+	- generator (str, "fake" or "big"): simulator, `sim.getFakeFast` (case 0,
+	four clusters) or `sim.getBigDatasetFast` (5x5 areas).
+
+	- rows, cols (int): lattice dimensions.
+
+	- taxa (int): number of distributions.
+
+	- geometry (str, "square" or "hexagon"): cell shape.
+	"""
+	def __init__(self, generator, rows, cols, taxa, geometry = "square"):
+		self.generator = generator
+		self.rows = rows
+		self.cols = cols
+		self.taxa = taxa
+		self.geometry = geometry
+		return None
+
+	@property
+	def name(self):
+		return "{0}-{1}x{2}-{3}-{4}".format(self.generator, self.rows, self.cols, self.geometry, self.taxa)
+
+	def generate(self, seed = 0):
+		"""
+		Returns the list of data.Tile objects of the dataset. The same seed
+		always produces the same dataset.
+		"""
+		if self.generator == "fake":
+			clus = 4
+			num = [self.taxa / clus + (1 if x < self.taxa % clus else 0) for x in xrange(clus)]
+			return sim.getFakeFast(0, clus = clus, num = num, inun = 0.9, exun = 0.9, height = self.rows, width = self.cols, geometry = self.geometry, seed = seed)
+		elif self.generator == "big":
+			clus = min((self.rows / 5) * (self.cols / 5), max(1, self.taxa / 2))
+			num = self.taxa / clus
+			return sim.getBigDatasetFast(clus = clus, num = num, inun = 0.9, exun = 0.9, noise = self.taxa - clus * num, height = self.rows, width = self.cols, geometry = self.geometry, seed = seed)
+		raise ValueError("Unknown dataset generator `{0}`.".format(self.generator))
+
+# Benchmarked routines. Each function sets up the routine on a list of tiles
+# and returns a callable executing it, so that setup is not timed.
+
+def benchGetDist(tiles):
+	sub = tiles[:30]
+	def run():
+		for ia in xrange(len(sub)):
+			for ib in xrange(ia):
+				data.getDist(sub[ia], sub[ib])
+	return run
+
+def benchEmea(tiles):
+	def run():
+		field = data.HMRF(template = tiles[0])
+		field.emea(tiles)
+	return run
+
+def benchPseudoLike(tiles):
+	field = data.HMRF(template = tiles[0])
+	field.emea(tiles)
+	def run():
+		field.pseudoLike(tiles)
+	return run
+
+def benchFieldPreSampler(tiles):
+	def run():
+		search.fieldPreSampler(tiles, 0.3)
+	return run
+
+def benchFieldOptim(tiles):
+	def run():
+		search.fieldOptim(tiles)
+	return run
+
+def benchHierarOptim(tiles):
+	def run():
+		search.hierarOptim(tiles)
+	return run
+
+benchmarks = {
+	"getDist": benchGetDist,
+	"emea": benchEmea,
+	"pseudoLike": benchPseudoLike,
+	"fieldPreSampler": benchFieldPreSampler,
+	"fieldOptim": benchFieldOptim,
+	"hierarOptim": benchHierarOptim,
+	}
+
+kernels = ["getDist", "emea", "pseudoLike"]
+searches = ["fieldPreSampler", "fieldOptim", "hierarOptim"]
+
+# Suites are lists of (benchmark names, dataset) tuples. Searches are quadratic
+# (or worse) on the number of taxa, so they only run on small taxa counts; the
+# exhaustive search of fieldOptim is also exponential on the number of seeds.
+suites = {
+	"quick": [
+		(kernels + searches, Dataset("fake", 10, 10, 12)),
+		(kernels + searches, Dataset("fake", 10, 10, 12, "hexagon")),
+		(kernels + searches, Dataset("big", 30, 30, 12)),
+		],
+	"grid": [(kernels, Dataset("fake", side, side, 20, geom)) for geom in ("square", "hexagon") for side in (10, 50, 100, 250, 500)]
+		+ [(searches, Dataset("fake", side, side, 20, geom)) for geom in ("square", "hexagon") for side in (10, 50, 100)],
+	"taxa": [(kernels, Dataset("fake", 10, 10, ntax, geom)) for geom in ("square", "hexagon") for ntax in (10, 100, 1000, 10000, 50000)]
+		+ [(searches, Dataset("fake", 10, 10, ntax, geom)) for geom in ("square", "hexagon") for ntax in (10, 100)]
+		+ [(kernels + ["fieldPreSampler", "hierarOptim"], Dataset("big", 30, 30, 72))],
+	}
+suites["full"] = suites["quick"] + suites["grid"] + suites["taxa"]
+
+def residentMemory():
+	"""
+	Returns the current resident memory of this process in kilobytes, or 0 if
+	it cannot be retrieved (only supported on Linux).
+	"""
+	try:
+		with open("/proc/self/statm") as fh:
+			pages = int(fh.read().split()[1])
+		return pages * os.sysconf("SC_PAGE_SIZE") / 1024
+	except (IOError, OSError, ValueError):
+		return 0
+
+def peakChild(conn, run):
+	baseline = residentMemory()
+	run()
+	if baseline:
+		conn.send(max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline))
+	else:
+		conn.send(None)
+	conn.close()
+
+def peakMemory(run):
+	"""
+	Returns the peak increase of resident memory in kilobytes during one
+	execution of `run`, or None if it cannot be measured. The execution takes
+	place in a process forked for it: the high-water mark of resident memory
+	of a forked process starts at its memory at fork time, so peaks of the
+	parent (such as generating the dataset) are not counted.
+	"""
+	parent, child = Pipe(False)
+	proc = Process(target = peakChild, args = (child, run))
+	proc.start()
+	try:
+		peak = parent.recv()
+	except EOFError:
+		peak = None
+	proc.join()
+	return peak
+
+def measure(benchmark, dataset, repeat = 3, seed = 0):
+	"""
+	Times a benchmark (name) on a dataset (Dataset object). Returns a dictionary
+	with the minimum and median wall time in seconds of `repeat` executions and
+	the peak increase of resident memory in kilobytes during another execution
+	(see `peakMemory`).
+	"""
+	tiles = dataset.generate(seed)
+	run = benchmarks[benchmark](tiles)
+	times = []
+	for r in xrange(repeat):
+		t0 = default_timer()
+		run()
+		times.append(default_timer() - t0)
+	memory = peakMemory(run)
+	times.sort()
+	return {"benchmark": benchmark, "dataset": dataset.name, "generator": dataset.generator,
+		"rows": dataset.rows, "cols": dataset.cols, "geometry": dataset.geometry, "taxa": len(tiles),
+		"repeat": repeat, "seconds": times[0], "median": times[len(times) / 2],
+		"memoryKB": memory}
+
+def measureChild(conn, benchmark, dataset, repeat, seed):
+	try:
+		conn.send(measure(benchmark, dataset, repeat, seed))
+	except Exception as err:
+		conn.send({"benchmark": benchmark, "dataset": dataset.name, "error": repr(err)})
+	conn.close()
+
+def run(suite = "quick", repeat = 3, seed = 0, select = None, progress = None):
+	"""
+	Runs a benchmark suite, each case in a new process. Returns a dictionary
+	with run metadata (key "meta") and the list of measurements (key
+	"results"). Failed cases are recorded with an "error" message.
+
+	Arguments:
+
+	- suite (str): name of the suite, a key of `suites`.
+
+	- repeat (int): executions per case.
+
+	- seed (int): random seed of the simulated datasets.
+
+	- select (list of str): only run these benchmarks.
+
+	- progress (callable): called with each measurement as it is finished.
+	"""
+	results = []
+	for names, dataset in suites[suite]:
+		for name in names:
+			if select is not None and name not in select:
+				continue
+			parent, child = Pipe(False)
+			proc = Process(target = measureChild, args = (child, name, dataset, repeat, seed))
+			proc.start()
+			try:
+				res = parent.recv()
+			except EOFError:
+				res = {"benchmark": name, "dataset": dataset.name, "error": "process exited with code {0}".format(proc.exitcode)}
+			proc.join()
+			results.append(res)
+			if progress is not None:
+				progress(res)
+	meta = {"suite": suite, "repeat": repeat, "seed": seed, "date": datetime.datetime.now().isoformat(),
+		"python": platform.python_version(), "numpy": numpy.__version__, "machine": platform.platform()}
+	return {"meta": meta, "results": results}
+
+def save(report, path):
+	with open(path, "w") as fh:
+		json.dump(report, fh, indent = 1, sort_keys = True)
+	return None
+
+def load(path):
+	with open(path) as fh:
+		return json.load(fh)
+
+def compare(baseline, current, timeTolerance = 0.25, memoryTolerance = 0.25):
+	"""
+	Compares two benchmark reports (as returned by `run`). Returns a list of
+	dictionaries, one per case present in both reports, with keys "benchmark",
+	"dataset", "timeRatio" and "memoryRatio" (current / baseline), and
+	"regression" (bool), True if a ratio exceeds 1 + tolerance. Minimum times
+	are compared, since they are the least sensitive to system load. Cases that
+	failed in the current report but not in the baseline are regressions.
+	"""
+	base = {}
+	for res in baseline["results"]:
+		base[(res["benchmark"], res["dataset"])] = res
+	out = []
+	for res in current["results"]:
+		key = (res["benchmark"], res["dataset"])
+		if key not in base:
+			continue
+		old = base[key]
+		row = {"benchmark": key[0], "dataset": key[1], "timeRatio": None, "memoryRatio": None, "regression": False}
+		if "error" in res:
+			row["regression"] = "error" not in old
+		elif "error" not in old:
+			if old["seconds"] > 0:
+				row["timeRatio"] = res["seconds"] / old["seconds"]
+				row["regression"] = row["timeRatio"] > 1.0 + timeTolerance
+			# Small allocations are within the resolution of resident memory
+			if old["memoryKB"] and res["memoryKB"] is not None and old["memoryKB"] >= 1024:
+				row["memoryRatio"] = float(res["memoryKB"]) / old["memoryKB"]
+				row["regression"] = row["regression"] or row["memoryRatio"] > 1.0 + memoryTolerance
+		out.append(row)
+	return out
@@ -0,0 +1,70 @@
+###############################################################################
+#
+#	Copyright 2016-2017 Nelson R. Salinas
+#
+#
+#	This file is part of Gloria.
+#
+#   Gloria is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+#	Gloria is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with Gloria.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+import argparse
+import sys
+from gloria_deps import bench
+
+parser = argparse.ArgumentParser(prog = 'python -m gloria_deps.bench', description = 'Gloria benchmarks on simulated datasets.')
+subparsers = parser.add_subparsers(dest = 'command')
+
+runParser = subparsers.add_parser('run', help = 'Run a benchmark suite and write its results to a JSON file.')
+runParser.add_argument('-o', '--outfile', required = True, dest = 'outfile', metavar = '<results.json>', action = 'store', help = 'Output file.')
+runParser.add_argument('-s', '--suite', dest = 'suite', default = 'quick', choices = sorted(bench.suites), action = 'store', help = 'Benchmark suite. Default = `quick`.')
+runParser.add_argument('-r', '--repeat', dest = 'repeat', metavar = '<#>', default = 3, type = int, action = 'store', help = 'Executions per case. Default = 3.')
+runParser.add_argument('--seed', dest = 'seed', metavar = '<#>', default = 0, type = int, action = 'store', help = 'Random seed of simulated datasets. Default = 0.')
+runParser.add_argument('-b', '--benchmark', dest = 'select', metavar = '<name>', default = None, action = 'append', choices = sorted(bench.benchmarks), help = 'Only run this benchmark (can be repeated).')
+
+compParser = subparsers.add_parser('compare', help = 'Compare results against a baseline; exits with status 1 if there are regressions.')
+compParser.add_argument('baseline', metavar = '<baseline.json>', action = 'store', help = 'Baseline results.')
+compParser.add_argument('current', metavar = '<results.json>', action = 'store', help = 'Results to check.')
+compParser.add_argument('-t', '--time-tolerance', dest = 'timeTolerance', metavar = '<#>', default = 0.25, type = float, action = 'store', help = 'Allowed relative increase of time. Default = 0.25.')
+compParser.add_argument('-m', '--memory-tolerance', dest = 'memoryTolerance', metavar = '<#>', default = 0.25, type = float, action = 'store', help = 'Allowed relative increase of peak memory. Default = 0.25.')
+
+args = parser.parse_args()
+
+def ratio(value):
+	if value is None:
+		return "-"
+	return "{0:.2f}".format(value)
+
+if args.command == 'run':
+	def report(res):
+		if "error" in res:
+			print "{0:<16}{1:<34}error: {2}".format(res["benchmark"], res["dataset"], res["error"])
+		else:
+			print "{0:<16}{1:<34}{2:>12.5f} s{3:>12} kB".format(res["benchmark"], res["dataset"], res["seconds"], res["memoryKB"])
+		sys.stdout.flush()
+	bench.save(bench.run(args.suite, args.repeat, args.seed, args.select, report), args.outfile)
+
+elif args.command == 'compare':
+	rows = bench.compare(bench.load(args.baseline), bench.load(args.current), args.timeTolerance, args.memoryTolerance)
+	regressions = 0
+	for row in rows:
+		flag = ""
+		if row["regression"]:
+			flag = "REGRESSION"
+			regressions += 1
+		print "{0:<16}{1:<34}time x{2:<8}memory x{3:<8}{4}".format(row["benchmark"], row["dataset"], ratio(row["timeRatio"]), ratio(row["memoryRatio"]), flag)
+	print "\n{0} cases compared, {1} regressions.".format(len(rows), regressions)
+	if regressions > 0:
+		sys.exit(1)
@@ -0,0 +1,89 @@
+###############################################################################
+#
+#	Copyright 2016-2017 Nelson R. Salinas
+#
+#
+#	This file is part of Gloria.
+#
+#   Gloria is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+#	Gloria is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with Gloria.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+
+import numpy
+from collections import OrderedDict
+
+class FieldCache(object):
+	"""
+	Bounded store of fitted fields, with least-recently-used eviction. Entries
+	are keyed by the index of the seed field the fit started from and the set of
+	observations it was fitted to (as a bitset), values are tuples of fitted
+	field (data.HMRF) and pseudolikelihood (float).
+
+	Hit, miss and eviction counters are kept to help sizing the cache.
+	"""
+	def __init__(self, maxSize = 128):
+		"""
+		Arguments:
+
+		- maxSize (int): maximum number of fitted fields kept in memory. A value of
+		0 disables the cache.
+		"""
+		self.maxSize = maxSize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.store = OrderedDict()
+		return None
+
+	def __len__(self):
+		return len(self.store)
+
+	def key(self, seedIndex, members, nobs):
+		"""
+		Returns the cache key of a seed field index (int) and an array of the
+		indexes of its member observations, out of `nobs` observations.
+		"""
+		mask = numpy.zeros(nobs, dtype = bool)
+		mask[members] = True
+		return (seedIndex, numpy.packbits(mask).tostring())
+
+	def get(self, key):
+		"""
+		Returns the (field, pseudolikelihood) tuple stored under `key`, or None.
+		"""
+		if key in self.store:
+			value = self.store.pop(key)
+			self.store[key] = value
+			self.hits += 1
+			return value
+		self.misses += 1
+		return None
+
+	def put(self, key, field, pseudolikelihood):
+		if self.maxSize < 1:
+			return None
+		if key in self.store:
+			self.store.pop(key)
+		elif len(self.store) >= self.maxSize:
+			self.store.popitem(last = False)
+			self.evictions += 1
+		self.store[key] = (field, pseudolikelihood)
+		return None
+
+	def stats(self):
+		"""
+		Returns a dictionary with hits, misses, evictions and current size.
+		"""
+		return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.store)}
@@ -20,6 +20,8 @@
 #
 ###############################################################################
 
+from libc.stdint cimport uint64_t
+
 cdef double getDistance(Tile tileA, Tile tileB) except -1
 
 cdef double euclidean(Tile tileA, Tile tileB) except -1
@@ -27,11 +29,23 @@ cdef double euclidean(Tile tileA, Tile tileB) except -1
 cdef class Tile:
 	cdef:
 		double[:,::1] mvsymbols
-		long[:,:,:,::1] mvneighref
+		unsigned char[:,::1] mvbytes # values of narrow Tiles
+		const long[::1] mvcells # sorted row-major indexes of presence cells of sparse Tiles
+		const long[:,:,:,::1] mvneighref # shared by all lattices of the same grid, see `neighborTable`
+		uint64_t[::1] mvbits # presence (cell == 1.0) packed in 64-bit words
+		long occupied # number of presence cells, valid while bitsStale is False or if sparse
+		bint bitsStale
 		double value
 		int ir, ic, ine, ind, ind2, neighsNum
 		readonly int rows, cols
 		readonly str geometry, name
+		readonly bint narrow, sparse
+		int packBits(self) except -1
+		int setNeighbors(self) except -1
+		int setStorage(self, grid, bint narrow) except -1
+		int setCells(self, cells, long rows, long cols) except -1
+		double cell(self, Py_ssize_t ir, Py_ssize_t ic)
+		int setCell(self, Py_ssize_t ir, Py_ssize_t ic, double value) except -1
 
 cdef class HMRF(Tile):
 
@@ -39,8 +53,19 @@ cdef class HMRF(Tile):
 		readonly double gamma
 		readonly double means[2]
 		readonly double staDevs[2]
+		readonly int iterations # emea statistics: parameter updates,
+		readonly long flips, evaluated # switched labels and evaluated cells
 		double[:,:,::1] mvprobabilities # holds probabilities for both symbols in tuples.
 		double[:,::1] mvaverobs  # holds observation mean by cell
+		float[:,::1] mvposterior # narrow fields: probability of symbol 1 by cell
+		float[:,::1] mvaverobs32 # narrow fields: observation mean by cell
+		unsigned char[:,:,::1] mvcounts # number of neighbors in state 0 and in state 1 by cell
+		bint countsStale
+		double energies[7] # prior energy by number of neighbors in another state
+		double logPriors[7][7][2] # log prior probability by neighbors in state 0, in state 1, and state
+		int setCell(self, Py_ssize_t ir, Py_ssize_t ic, double value) except -1
+		int setGammaTables(self) except -1
+		int refreshCounts(self) except -1
 		double indLike(self, float obs, double statein) except? -1000.0
 		double indPrior(self, int indRow, int indCol) except? -1.0
 		double logGaussPDF(self, double mean, double staDev, double observation) except? 1000
@@ -48,3 +73,6 @@ cdef class HMRF(Tile):
 		double logGaussScaled(self, double mean, double staDev, double observation) except? 1000
 		double ufunction(self, int indRow, int indCol) except? -1.0
 		double bhadist(self)
+		double average(self, int indRow, int indCol)
+		double posterior(self, int indRow, int indCol, int state)
+		int setAverages(self, obserIn) except -1
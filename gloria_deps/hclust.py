@@ -21,15 +21,21 @@
 ###############################################################################
 
 import fastcluster
+import numpy
 import phylo
-from data import getDist, HMRF
+from data import getDist, distCondensed, HMRF
 
 def dist_tree(distance_matrix, link_alg = 'UPGMA'):
+	"""
+	Returns a phylo.Tree object from a condensed distance matrix (as returned
+	by `dist_matrix`).
+	"""
+	leaves = int(round((1 + (1 + 8 * len(distance_matrix)) ** 0.5) / 2))
 	if link_alg == 'UPGMA':
 		z = fastcluster.linkage(distance_matrix, method='average')
 
 	if len(z) > 0:
-		tree = phylo.Tree(len(distance_matrix))
+		tree = phylo.Tree(leaves)
 		tree.linking_matrix = z
 		for row in z:
 			left = int(row[0])
@@ -51,15 +57,20 @@ def dist_tree(distance_matrix, link_alg = 'UPGMA'):
 
 def dist_matrix(observations, distance_function):
 	"""
-	Returns a distance matrix from a list of Tile objects. Argument 0 is a list
-	of objects, argument 1 is a function to measure their pairwise distance.
+	Returns a condensed distance matrix (upper triangle of the symmetric
+	matrix, as a contiguous numpy array) from a list of Tile objects. Argument
+	0 is a list of objects, argument 1 is a function to measure their pairwise
+	distance. Kulczynski distances (`data.getDist`) are computed natively.
 	"""
-	mat = [[x for x in xrange(len(observations))]
-			for y in xrange(len(observations))]
-	for row in xrange(len(observations)):
-		for col in xrange(len(observations)):
-			mat[row][col] = distance_function(observations[row],
-									observations[col])
+	if distance_function is getDist:
+		return distCondensed(observations)
+	nobs = len(observations)
+	mat = numpy.empty((nobs * (nobs - 1)) // 2, dtype=float)
+	pos = 0
+	for row in xrange(nobs):
+		for col in xrange(row + 1, nobs):
+			mat[pos] = distance_function(observations[row], observations[col])
+			pos += 1
 	return mat
 
 def clade2field(tree, node, observations, gamma_in):
@@ -22,20 +22,48 @@
 
 import csv
 import re
+import numpy
+from itertools import islice
 from math import ceil, sin, radians
 import data
 
 sin30 = 0.5
 sin60 = sin(radians(60))
 sin90 = 1.0
+allowedChars = numpy.zeros(256, dtype = bool) # characters of coordinate values; zero pads numpy strings
+allowedChars[[0, ord("."), ord("-")] + range(ord("0"), ord("9") + 1)] = True
+
+def parseCoordinates(values, limit):
+	"""
+	Converts an array of strings into an array of floats. Values containing
+	characters other than digits, periods and hyphens, values that cannot be
+	parsed, and values beyond +/- `limit` are set to NaN.
+	"""
+	out = numpy.full(len(values), numpy.nan)
+	if len(values) == 0:
+		return out
+	codes = values.view(numpy.uint8).reshape(len(values), -1)
+	good = allowedChars[codes].all(axis = 1) & (values != "")
+	try:
+		out[good] = values[good].astype(float)
+	except ValueError:
+		# Malformed numbers (e.g. "1.2.3") are rare, convert one by one
+		for ix in numpy.flatnonzero(good):
+			try:
+				out[ix] = float(values[ix])
+			except ValueError:
+				pass
+	with numpy.errstate(invalid = 'ignore'):
+		out[(out < -limit) | (out > limit)] = numpy.nan
+	return out
 
 class InputData(object):
 	"""
 	Input data processor class. Class constructor requires a csv file (str) with
-	three columns: longitude, latitude, and taxon name.
+	three columns: longitude, latitude, and taxon name. The file is parsed in
+	chunks of `chunkSize` lines, each validated and converted as a whole.
 	"""
-	def __init__(self,infile):
-		self.points = {}
+	def __init__(self, infile, chunkSize = 100000):
 		self.minLatitude = 91.0
 		self.maxLatitude = -91.0
 		self.minLongitude = 181.0
@@ -47,71 +75,171 @@ class InputData(object):
 		self.rows = None
 		self.cols = None
 		self.geometry = None
+		self.presence = None # sorted indexes of presence cells in the flattened `cube` of the last grid, set by getTiles
+		self.presenceCube = None # `cube`, once built
 		self.csvfile = infile
+		self.taxa = [] # taxon names (interned), sorted; taxon codes are indexes in this list
+		self.taxonCodes = None # int32 array, taxon code of each unique record
+		self.longitudes = None # float64 array, longitude of each unique record
+		self.latitudes = None # float64 array, latitude of each unique record
+		self.taxonBounds = None # records of taxon code i are in taxonBounds[i]:taxonBounds[i+1]
+		taxonIndex = {}
 		lineCounter = 0
 		latCol = int()
 		lonCol = int()
+		codes, lons, lats = [], [], []
 
 		with open(infile,'r') as fil:
 			table = csv.reader(fil)
-			for row in table:
-				lineCounter += 1
-				if lineCounter == 1 and (re.search("[^0-9\.\-]",row[1]) or re.search("[^0-9\.\-]",row[2])):
+			chunk = list(islice(table, 1))
+			if len(chunk) > 0 and len(chunk[0]) >= 3:
+				row = chunk[0]
+				if re.search("[^0-9\.\-]",row[1]) or re.search("[^0-9\.\-]",row[2]):
 					if re.search("lon(gitude)*",row[1],flags=re.I) and re.search("lat(itude)*",row[2],flags=re.I):
 						latCol, lonCol = 2, 1
-						continue
 					elif re.search("lon(gitude)*",row[2],flags=re.I) and re.search("lat(itude)*",row[1],flags=re.I):
 						latCol, lonCol = 1, 2
-						continue
 					else:
 						raise IOError("Input file `{0}`: column labels do not follow the required format (`Longitude`, `Latitude`).".format(infile))
+					lineCounter = 1
+					chunk = []
+
+			chunk += list(islice(table, chunkSize))
+			while len(chunk) > 0:
+				names, lon, lat = self.parseChunk(chunk, lineCounter + 1, latCol, lonCol)
+				lineCounter += len(chunk)
+				uniqNames, inverse = numpy.unique(names, return_inverse = True)
+				for nm in uniqNames:
+					if nm not in taxonIndex:
+						taxonIndex[nm] = len(self.taxa)
+						self.taxa.append(intern(str(nm)))
+				codes.append(numpy.array([taxonIndex[nm] for nm in uniqNames], dtype = numpy.int32)[inverse])
+				lons.append(lon)
+				lats.append(lat)
+				chunk = list(islice(table, chunkSize))
+
+		if len(self.taxa) < 2:
+			raise ValueError("Input file only contain distribution data from {0} species (at least two are required).".format(len(self.taxa)))
+
+		codes = numpy.concatenate(codes)
+		lons = numpy.concatenate(lons)
+		lats = numpy.concatenate(lats)
+		self.minLatitude = float(lats.min())
+		self.maxLatitude = float(lats.max())
+		self.minLongitude = float(lons.min())
+		self.maxLongitude = float(lons.max())
+
+		# Taxon codes follow alphabetic order, whatever the chunk size
+		alpha = numpy.argsort(self.taxa)
+		recode = numpy.empty(len(self.taxa), dtype = numpy.int32)
+		recode[alpha] = numpy.arange(len(self.taxa), dtype = numpy.int32)
+		codes = recode[codes]
+		self.taxa = [self.taxa[x] for x in alpha]
+
+		# Sort records by taxon and coordinates, duplicated records are removed
+		order = numpy.lexsort((lats, lons, codes))
+		codes, lons, lats = codes[order], lons[order], lats[order]
+		del order
+		keep = numpy.ones(len(codes), dtype = bool)
+		keep[1:] = (codes[1:] != codes[:-1]) | (lons[1:] != lons[:-1]) | (lats[1:] != lats[:-1])
+		self.taxonCodes = codes[keep]
+		self.longitudes = lons[keep]
+		self.latitudes = lats[keep]
+		self.taxonBounds = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(self.taxonCodes, minlength = len(self.taxa)))))
 
-				if len(row) > 3:
-					raise IOError("Line {0} in `{1}` contains more than three columns.".format(lineCounter, infile))
-				row[2] = re.sub("[\s\'\"]","",row[2])
-				row[1] = re.sub("[\s\'\"]","",row[1])
-
-				if len(row[latCol]) < 1:
-					raise IOError("Line {0} in `{1}` do not contain latitude data.".format(lineCounter, infile))
-				if re.search("[^0-9\.\-]",row[latCol]) or float(row[latCol]) < -90 or float(row[latCol]) > 90:
-					raise IOError("Line {0} in `{1}` contains invalid coordinate value(s): `{2}`.".format(lineCounter, infile, row[latCol]))
-
-				if len(row[lonCol]) < 1:
-					raise IOError("Line {0} in `{1}` do not contain longitude data.".format(lineCounter, infile))
-				if re.search("[^0-9\.\-]",row[lonCol]) or float(row[lonCol]) < -180 or float(row[lonCol]) > 180:
-					raise IOError("Line {0} in `{1}` contains invalid coordinate value(s): `{2}`.".format(lineCounter, infile, row[lonCol]))
-
-				lat = float(row[latCol])
-				lon = float(row[lonCol])
-
-				if len(row[0]) > 90:
-					raise IOError("Are you sure {0} is a correct taxon name? (line {0} in file `{1}`)".format(row[0],lineCounter, infile))
-
-				if row[0] in self.points:
-					self.points[row[0]][(lon,lat)] = 0
-				else:
-					self.points[row[0]] = { (lon,lat) : 0 }
+		return None
 
-				if self.minLatitude > lat:
-					self.minLatitude = lat
-				if self.maxLatitude < lat:
-					self.maxLatitude = lat
-				if self.minLongitude > lon:
-					self.minLongitude = lon
-				if self.maxLongitude < lon:
-					self.maxLongitude = lon
+	@property
+	def cube(self):
+		"""
+		Presence array (uint8, taxa x rows x columns) of the last grid set by
+		`getTiles`, built on first use from attribute `presence`.
+		"""
+		if self.presenceCube is None and self.presence is not None:
+			self.presenceCube = numpy.zeros((len(self.taxa), self.rows, self.cols), dtype = numpy.uint8)
+			self.presenceCube.reshape(-1)[self.presence] = 1
+		return self.presenceCube
 
-		if len(self.points) < 2:
-			raise ValueError("Input file only contain distribution data from {0} species (at least two are required).".format(len(self.points)))
+	@property
+	def points(self):
+		"""
+		Dictionary of taxon names to dictionaries of (longitude, latitude) tuples
+		(values are 0). Built on each call from the record arrays, kept for
+		compatibility.
+		"""
+		out = {}
+		lons, lats = self.longitudes.tolist(), self.latitudes.tolist()
+		for co, name in enumerate(self.taxa):
+			start, end = self.taxonBounds[co], self.taxonBounds[co + 1]
+			out[name] = dict.fromkeys(zip(lons[start:end], lats[start:end]), 0)
+		return out
+
+	def taxonRecords(self, code):
+		"""
+		Returns the longitudes and latitudes (numpy arrays) of a taxon code.
+		"""
+		start, end = self.taxonBounds[code], self.taxonBounds[code + 1]
+		return self.longitudes[start:end], self.latitudes[start:end]
 
-		return None
+	def parseChunk(self, rows, firstLine, latCol, lonCol):
+		"""
+		Validates and converts a list of csv rows (lists of str) into a tuple of
+		numpy arrays: taxon names, longitudes, and latitudes. `firstLine` is the
+		line number of the first row, used in error messages. Rows are validated
+		as a whole; if any is invalid, an IOError is raised for the first one.
+		"""
+		infile = self.csvfile
+		lines = firstLine + numpy.flatnonzero([len(r) > 0 for r in rows]) # blank lines are skipped
+		rows = [r for r in rows if len(r) > 0]
+		size = len(rows)
+		ncols = numpy.array([len(r) for r in rows], dtype = int)
+
+		# Structural errors are reported after any value error in previous rows
+		shapeErrors = numpy.flatnonzero(ncols != 3)
+		valid = size
+		if len(shapeErrors) > 0:
+			valid = shapeErrors[0]
+
+		columns = zip(*rows[:valid]) or [(), (), ()]
+		names = numpy.array(columns[0], dtype = str)
+		cols = {}
+		for ic in (1, 2):
+			cols[ic] = numpy.array([x.translate(None, " \t\n\r\x0b\x0c\'\"") for x in columns[ic]], dtype = str)
+		if latCol == 0:
+			# No header: coordinates are read from the first column, as before
+			cols[0] = names
+		latStr, lonStr = cols[latCol], cols[lonCol]
+		lat = parseCoordinates(latStr, 90.0)
+		lon = parseCoordinates(lonStr, 180.0)
+
+		checks = [
+			(latStr == "", lambda x: "Line {0} in `{1}` do not contain latitude data.".format(lines[x], infile)),
+			(numpy.isnan(lat), lambda x: "Line {0} in `{1}` contains invalid coordinate value(s): `{2}`.".format(lines[x], infile, latStr[x])),
+			(lonStr == "", lambda x: "Line {0} in `{1}` do not contain longitude data.".format(lines[x], infile)),
+			(numpy.isnan(lon), lambda x: "Line {0} in `{1}` contains invalid coordinate value(s): `{2}`.".format(lines[x], infile, lonStr[x])),
+			(numpy.char.str_len(names) > 90, lambda x: "Are you sure {0} is a correct taxon name? (line {1} in file `{2}`)".format(names[x], lines[x], infile)),
+			]
+		failed = numpy.zeros(valid, dtype = bool)
+		for mask, message in checks:
+			failed |= mask
+		if failed.any():
+			first = numpy.flatnonzero(failed)[0]
+			for mask, message in checks:
+				if mask[first]:
+					raise IOError(message(first))
+
+		if valid < size:
+			if ncols[valid] > 3:
+				raise IOError("Line {0} in `{1}` contains more than three columns.".format(lines[valid], infile))
+			raise IOError("Line {0} in `{1}` contains less than three columns.".format(lines[valid], infile))
+
+		return names, lon, lat
 
 	def getStats(self):
-		spp = len(self.points)
-		uniqPoints = 0
-		for sp in self.points:
-			uniqPoints += len(self.points[sp])
-		return (spp, uniqPoints)
+		"""
+		Returns a tuple of the number of taxa and the number of unique records.
+		"""
+		return (len(self.taxa), len(self.taxonCodes))
 
 	def hexcode(self, lon, lat, DAref):
 		"""
@@ -147,10 +275,41 @@ class InputData(object):
 				break
 		return (thisRow, thisCol)
 
-	def getTiles(self, cellSize, geometry = "square", offsetLat = 0.0, offsetLon = 0.0):
+	def hexcodes(self, lons, lats, DAref):
+		"""
+		Array version of `hexcode`: converts arrays of longitudes and latitudes
+		into arrays of row and column indexes (int) of the hexagonal grid.
+		Operations follow those of `hexcode`, so results are identical.
+		"""
+		DAdist = (((lats - self.originS[1]) + ((lons - self.originS[0]) / (sin60 * 2.0))) * sin60)
+		ADAdist = (((self.originN[1] - lats) + ((lons - self.originN[0]) / (sin60 * 2.0))) * sin60)
+		da_ = numpy.trunc(DAdist / (self.cellSize / 2.0)) - DAref
+		ada_ = numpy.trunc(ADAdist / (self.cellSize / 2.0))
+		ha_ = numpy.trunc((lons - self.originN[0]) / (self.cellSize / 2.0))
+		thisRow = numpy.zeros(len(lons), dtype = int)
+		thisCol = numpy.zeros(len(lons), dtype = int)
+		pending = numpy.ones(len(lons), dtype = bool)
+		for ca in self.cases:
+			ada = ada_ + ca[0]
+			da = da_ + ca[1]
+			ha = ha_ + ca[2]
+			# Float modulo of numpy follows the sign of the divisor, as in Python
+			found = pending & (ada + da == ha) & (numpy.mod(ada - da, 3) == 0)
+			rows = numpy.trunc((ada[found] - da[found]) / 3)
+			hs = ha[found]
+			thisRow[found] = rows
+			thisCol[found] = numpy.where(numpy.mod(rows, 2.0) == 0, numpy.trunc(hs / 2), numpy.trunc((hs - 1) / 2))
+			pending &= ~found
+		return thisRow, thisCol
+
+	def getTiles(self, cellSize, geometry = "square", offsetLat = 0.0, offsetLon = 0.0, narrow = False, sparse = None):
 		"""
 		Create basic data structures required for the analysis from a collection
-		of distributional points. Returns a list of data.Tile objects.
+		of distributional points. Returns a list of data.Tile objects, one per
+		taxon (in the order of attribute `taxa`). The presence of every taxon in
+		every cell is also available in attribute `cube`, a uint8 array of shape
+		(taxa, rows, columns) built on first use, for code that processes all
+		taxa at once.
 
 		Arguments:
 
@@ -162,6 +321,16 @@ class InputData(object):
 		If it is made of hexagons, it will be the length of the shorter line
 		traversing the hexagon through the center (== 2 * apothem).
 
+		- narrow (bool): return narrow Tiles (values stored as bytes), which are
+		views of `cube` and take no additional memory. `cube` is then built at
+		once and made read-only. Dense Tiles are built from the presence cells
+		of their taxon, without `cube`.
+
+		- sparse (bool or None): return sparse Tiles (indexes of presence cells,
+		see data.Tile), built from the records without walking the lattice. If
+		None, a taxon gets a sparse Tile if `data.preferSparse` of its number of
+		presence cells, otherwise a dense (or narrow) one.
+
 		"""
 		self.cellSize = float(cellSize)
 		self.geometry = geometry
@@ -178,21 +347,12 @@ class InputData(object):
 			totCols = int(ceil(span[0] / self.cellSize))
 			totRows = int(ceil(span[1] / self.cellSize))
 			self.rows, self.cols = totRows, totCols
-			for taxon in self.points:
-				grid = [[0 for x in xrange(totCols)] for x in xrange(totRows)]
-				for lon,lat in self.points[taxon]:
-					apprindx = ceil(((lon - self.originN[0]) / span[0]) * totCols)
-					apprindy = ceil(((self.originN[1] - lat) / span[1]) * totRows)
-					if apprindx == 0:
-						x = 0
-					else:
-						x = int(apprindx - 1)
-					if apprindy == 0:
-						y = 0
-					else:
-						y = int(apprindy - 1)
-					grid[y][x] = 1
-				tileStack.append(data.Tile(ingrid = grid, cellType = geometry, name = taxon))
+			# All records are binned at once
+			apprindx = numpy.ceil(((self.longitudes - self.originN[0]) / span[0]) * totCols)
+			apprindy = numpy.ceil(((self.originN[1] - self.latitudes) / span[1]) * totRows)
+			x = numpy.where(apprindx == 0, 0, apprindx - 1).astype(int)
+			y = numpy.where(apprindy == 0, 0, apprindy - 1).astype(int)
+			recRows, recCols = y, x
 
 		elif geometry == "hexagon":
 			# Get handy hexagonal dimensions
@@ -230,30 +390,44 @@ class InputData(object):
 			else:
 				DAref = int(((self.originN[1] - self.originS[1] + (hexSide / 2.0)) * sin60) / (self.cellSize / 2.0)) - 1
 
-			cases = ((0,0,0), (0,-1,0), (0,-1,-1), (-1,-1,-1), (-1,0,-1), (-1,0,0)) # for 3- to 2-dimensional index conversion
-			for taxon in self.points:
-				grid = [[0 for x in xrange(totCols)] for x in xrange(totRows)]
-				for lon,lat in self.points[taxon]:
-					#print "lon: ",lon,", lat: ",lat
-					thisRow, thisCol = self.hexcode(lon, lat, DAref)
-					try:
-						grid[thisRow][thisCol] = 1
-					except IndexError:
-						fakeLon, fakeLat = lon, lat
-						if thisCol == totCols:
-							fakeLon -= correctionFactor
-						elif thisCol < 0:
-							fakeLon += correctionFactor
-						if thisRow == totRows:
-							fakeLat += correctionFactor
-						elif thisRow < 0:
-							fakeLat -= correctionFactor
-						thisRow, thisCol = self.hexcode(fakeLon, fakeLat, DAref)
-						grid[thisRow][thisCol] = 1
-
-				tileStack.append(data.Tile(ingrid = grid, cellType = geometry, name = taxon))
+			thisRow, thisCol = self.hexcodes(self.longitudes, self.latitudes, DAref)
+
+			# Points beyond the grid border are nudged into it. Negative indexes
+			# within the grid size wrap around, as they always did.
+			outside = (thisRow >= totRows) | (thisRow < -totRows) | (thisCol >= totCols) | (thisCol < -totCols)
+			if outside.any():
+				fakeLon = self.longitudes[outside]
+				fakeLat = self.latitudes[outside]
+				rows, cols = thisRow[outside], thisCol[outside]
+				fakeLon = numpy.where(cols == totCols, fakeLon - correctionFactor, numpy.where(cols < 0, fakeLon + correctionFactor, fakeLon))
+				fakeLat = numpy.where(rows == totRows, fakeLat + correctionFactor, numpy.where(rows < 0, fakeLat - correctionFactor, fakeLat))
+				thisRow[outside], thisCol[outside] = self.hexcodes(fakeLon, fakeLat, DAref)
+
+			recRows, recCols = thisRow, thisCol
 
 		else:
 			raise ValueError("Valid values for argument `geometry` are `square` and `hexagon`.")
 
+		# Presence cells of each taxon (row-major indexes, negative indexes
+		# wrap around), sorted by taxon and cell. These are also the indexes of
+		# presence in the flattened cube, which is only built for narrow Tiles.
+		cells = self.rows * self.cols
+		keys = numpy.unique(self.taxonCodes.astype(numpy.int64) * cells + (recRows % self.rows) * self.cols + (recCols % self.cols))
+		bounds = numpy.searchsorted(keys // cells, numpy.arange(len(self.taxa) + 1))
+		self.presence = keys
+		self.presenceCube = None
+
+		for code, taxon in enumerate(self.taxa):
+			occupied = bounds[code + 1] - bounds[code]
+			if sparse or (sparse is None and data.preferSparse(occupied, cells)):
+				tileStack.append(data.occurrenceTile(keys[bounds[code]:bounds[code + 1]] - code * cells, self.rows, self.cols, geometry, taxon))
+			elif narrow:
+				tileStack.append(data.Tile(ingrid = self.cube[code], cellType = geometry, name = taxon, narrow = True))
+			else:
+				grid = numpy.zeros(cells, dtype = numpy.float64)
+				grid[keys[bounds[code]:bounds[code + 1]] - code * cells] = 1
+				tileStack.append(data.Tile(ingrid = grid.reshape((self.rows, self.cols)), cellType = geometry, name = taxon))
+		if narrow and self.presenceCube is not None:
+			self.presenceCube.flags.writeable = False
+
 		return tileStack
@@ -23,90 +23,167 @@
 import numpy
 from math import factorial, log, exp, pi
 
-def aic(dic):
+class ModelScores(object):
+	"""
+	Model selection scores of a partition of observations among fields.
+	Pseudolikelihood terms are estimated once, when a score first needs them,
+	and are shared by all scores derived from them (PLIC, AIC, weighted and
+	mixture probabilities).
+	"""
+	def __init__(self, dic, plikefunc = 'raw', pslikes = None):
+		"""
+		Arguments:
+
+		- dic: a dictionary with Markov Random Fields (data.HMRF) as keys and
+		lists of their observations (data.Tile) as values.
+
+		- plikefunc (str): likelihood form of pseudolikelihoods (`raw`, `scaled`
+		or `pmf`), see data.HMRF.pseudoLike. AIC always uses the raw form.
+
+		- pslikes (dict, optional): pseudolikelihoods already estimated for the
+		fields with `plikefunc`.
+		"""
+		for key in dic:
+			assert len(dic[key]) > 0, "Cluster has no elements (modelSel.ModelScores)."
+		self.dic = dic
+		self.plikefunc = plikefunc
+		self.numpars = float(len(dic)) * 5.0 # mean and standard deviation per each state plus a parameter for the prior energy function
+		self.nelems = sum([len(dic[key]) for key in dic])
+		self.N = 0.0
+		for key in dic:
+			self.N += float(len(dic[key]) * key.rows * key.cols)
+		self.terms = {} # (form, field): pseudolikelihood of the field on its observations
+		if pslikes is not None:
+			for key in pslikes:
+				if key in dic:
+					self.terms[(plikefunc, key)] = pslikes[key]
+		self.allObsTerms = None # pseudolikelihood of each field on all observations
+		self.obsTerms = None # pseudolikelihood of each field on each of its observations
+		return None
+
+	def term(self, field, form = None):
+		"""
+		Returns the pseudolikelihood of a field on its observations, with
+		likelihood form `form` (default is `plikefunc`).
+		"""
+		if form is None:
+			form = self.plikefunc
+		if (form, field) not in self.terms:
+			self.terms[(form, field)] = field.pseudoLike(self.dic[field], form)
+		return self.terms[(form, field)]
+
+	def pseudolikelihood(self):
+		"""
+		Sum of the pseudolikelihoods of the fields.
+		"""
+		pseudo = 0.0
+		for key in self.dic:
+			pseudo += self.term(key)
+		return pseudo
+
+	def plic(self, mixture = False, debbug = False):
+		"""
+		Pseudolikelihood Information Criterion. If `mixture`, the
+		pseudolikelihood of each field is estimated on all observations.
+		"""
+		if len(self.dic) == 0:
+			return 0.0
+		if mixture and self.allObsTerms is None:
+			allObs = [obs for key in self.dic for obs in self.dic[key]]
+			self.allObsTerms = {}
+			for key in self.dic:
+				self.allObsTerms[key] = key.pseudoLike(allObs, self.plikefunc)
+		plicv = 0.0
+		for key in self.dic:
+			if mixture:
+				thisPL = self.allObsTerms[key]
+			else:
+				thisPL = self.term(key)
+			if debbug:
+				print "Field {0}, observations: {1},".format(id(key), len(self.dic[key])),
+				if key.isNull():
+					print "null field, ",
+				print "pseudolikelihood: {0}".format(thisPL)
+			plicv += thisPL
+		return (2 * plicv) - (log(self.N) * self.numpars)
+
+	def aic(self):
+		"""
+		Akaike Information Criterion, from raw pseudolikelihoods.
+		"""
+		aic = 0.0
+		for key in self.dic:
+			aic += self.term(key, 'raw')
+		return ((-2.0) * aic) + (2.0 * self.numpars)
+
+	def weighted(self):
+		"""
+		Sum of the pseudolikelihoods of the fields, each weighted by the
+		proportion of observations it holds.
+		"""
+		pseudo = 0.0
+		for field in self.dic:
+			weight = len(self.dic[field]) / float(self.nelems)
+			this_prob = log(weight) + self.term(field)
+			pseudo += this_prob
+		return pseudo
+
+	def mixture(self):
+		"""
+		Mixture probability of observations, from the pseudolikelihoods of each
+		field on each of its observations.
+		"""
+		if self.obsTerms is None:
+			self.obsTerms = {}
+			for field in self.dic:
+				self.obsTerms[field] = [field.pseudoLike([obs], distr_form = self.plikefunc) for obs in self.dic[field]]
+		pseudo = 0.0
+		for field in self.dic:
+			weight = len(self.dic[field]) / float(self.nelems)
+			for obsPL in self.obsTerms[field]:
+				this_prob = log(weight) + obsPL
+				pseudo += exp(this_prob)
+			try:
+				pseudo = log(pseudo)
+			except:
+				pseudo = -745.0
+		return pseudo
+
+	def plicMixture(self):
+		return (2 * self.mixture()) - (log(self.N) * self.numpars)
+
+	def plicWeighted(self):
+		return (2 * self.weighted()) - (log(self.N) * self.numpars)
+
+def aic(dic, pslikes = None):
 	"""
 	Receives a dictionary of Tile objects, typically the dic attribute of a
 	Cluster object. Keys are a Markov Random Fields, values are list of cluster
-	elements.
+	elements. Pseudolikelihoods (raw) already estimated for the fields can be
+	parsed as a dictionary through `pslikes`.
 	"""
-	aic = 0.0
-	numpars = float(len(dic)) * 5.0 # mean and standard deviation per each state plus a parameter for the prior energy function
-	for key in dic:
-		assert len(dic[key]) > 0, "Cluster has no elements (modelSel.aic)."
-		aic += key.pseudoLike(dic[key])
-	aic = ((-2.0) * aic) + (2.0 * numpars)
-	return aic
-
-def plic(dic , plikefunc, mixture = False, ms_debbug = False):
+	return ModelScores(dic, 'raw', pslikes).aic()
+
+def plic(dic , plikefunc, mixture = False, ms_debbug = False, pslikes = None):
 	"""
 	Receives a dictionary of Tile objects, typically the dic attribute of a
 	Cluster object. Keys are Markov Random Fields, values are list of cluster
-	elements.
+	elements. Pseudolikelihoods already estimated for the fields (with
+	`plikefunc`) can be parsed as a dictionary through `pslikes`.
 	"""
-	nkeys = len(dic)
-	mylambda = 3.0
-	plicv = 0.0
-	numpars = float(len(dic)) * 5.0 # mean and standard deviation per each state plus a parameter for the prior energy function
-	N = 0.0
-	allObs = reduce(lambda x,y: x+y, dic.values())
-	for key in dic:
-		if ms_debbug:
-			print "Field {0}, observations: {1},".format(id(key), len(dic[key])),
-		assert len(dic[key]) > 0, "Cluster has no elements (modelSel.plic)."
-		if ms_debbug and key.isNull():
-			print "null field, ",
-		if mixture:
-			thisPL = key.pseudoLike(allObs, plikefunc)
-		else:
-			thisPL = key.pseudoLike(dic[key], plikefunc)
-		if ms_debbug:
-			print "pseudolikelihood: {0}".format(thisPL)
-		plicv += thisPL
-		N += float(len(dic[key]) * key.rows * key.cols)
-
-	if len(dic) == 0:
-		plicv = 0.0
-	else:
-		plicv = (2 * plicv) - (log(N) * numpars)
-	return plicv
+	return ModelScores(dic, plikefunc, pslikes).plic(mixture, ms_debbug)
 
 
 def weighted_prob(dic, pslikeFunc = 'raw'):
-	nelems = len(reduce(lambda x,y: x+y, dic.values()))
-	pseudo = 0.0
-	for field in dic:
-		weight = len(dic[field]) / float(nelems)
-		this_prob = log(weight) + field.pseudoLike(dic[field], distr_form = pslikeFunc)
-		#print "this logprob:",this_prob
-		pseudo += this_prob
-	return pseudo
+	return ModelScores(dic, pslikeFunc).weighted()
 
 
 def mixture_prob(dic, pslikeFunc = 'raw'):
-	nelems = len(reduce(lambda x,y: x+y, dic.values()))
-	pseudo = 0.0
-	for field in dic:
-		weight = len(dic[field]) / float(nelems)
-		for obs in dic[field]:
-			this_prob = log(weight) + field.pseudoLike([obs], distr_form = pslikeFunc)
-			pseudo += exp(this_prob)
-		try:
-			pseudo = log(pseudo)
-		except:
-			pseudo = -745.0
-	return pseudo
+	return ModelScores(dic, pslikeFunc).mixture()
 
 
 def plic_mixture(dic, pslikeplic = 'raw'):
-	logprob = mixture_prob(dic, pslikeplic)
-	N = float(sum([(len(dic[key]) * key.rows * key.cols) for key in dic]))
-	numpars = float(len(dic)) * 5.0 # mean and standard deviation per each state plus a parameter for the prior energy function
-	plic = (2 * logprob) - (log(N) * numpars)
-	return plic
+	return ModelScores(dic, pslikeplic).plicMixture()
 
 def plic_weigthed(dic, pslikeplic = 'raw'):
-	logprob = weighted_prob(dic, pslikeplic)
-	N = float(sum([(len(dic[key]) * key.rows * key.cols) for key in dic]))
-	numpars = float(len(dic)) * 5.0 # mean and standard deviation per each state plus a parameter for the prior energy function
-	plic = (2 * logprob) - (log(N) * numpars)
-	return plic
+	return ModelScores(dic, pslikeplic).plicWeighted()
@@ -29,6 +29,9 @@ class Ensemble(object):
 		self.field2taxa = {}
 		self.components = int()
 		self.noise = []
+		self.cacheStats = {}
+		self.cycles = [] # a dictionary per model selection cycle
+		self.truncated = False # search stopped by time limit or interruption
 		return None
 
 	def __str__(self):
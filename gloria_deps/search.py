@@ -22,32 +22,59 @@
 
 import data
 import modelSel
+import cache
+import trace
+import numpy
+import signal
 import sys
+import time
 import rescon
 import hclust
 from math import factorial, log, exp, pi
-from itertools import combinations
-from random import sample
+from itertools import combinations, islice
+from collections import deque, OrderedDict
+from multiprocessing import Pool
+from random import sample, Random
 
+poolTimeout = 1e7 # seconds; waiting with a timeout keeps the main process responsive to interruptions
 
-def fieldPreSampler(observations, cohesion, debbug = False):
-	preFields = {}
+
+def fieldPreSampler(observations, cohesion, debbug = False, deadline = None):
+	"""
+	Estimates seed fields from clusters of observations around each observation.
+	Returns an ordered dictionary of fields to pseudolikelihoods. If `deadline`
+	(as returned by time.time) is passed, sampling stops and the fields
+	estimated so far are returned.
+	"""
+	preFields = OrderedDict() # keeps seed order reproducible among runs
 	bitRecord = []
+	dists = data.distMatrix(observations)
 
-	for ite in observations:
+	for im, ite in enumerate(observations):
+		if deadline is not None and time.time() > deadline:
+			break
 		medoid = ite
 		cluster = []
-		for o in observations:
-			if data.getDist(o,medoid) < cohesion:
+		for io, o in enumerate(observations):
+			if dists[io, im] < cohesion:
 				cluster.append(o)
 		if len(cluster) > 1:
 			fieldie = data.HMRF(template=medoid)
-			fieldie.emea(cluster)
+			clusterSum = (data.sumTiles(cluster), len(cluster)) # summed once for emea and pseudoLike
+			if trace.enabled:
+				t0 = time.time()
+			fieldie.emea(clusterSum)
+			if trace.enabled:
+				trace.accumulate("emea", time.time() - t0)
 			bits = fieldie.toBits()
 			if bits not in bitRecord:
 				#print bits
 				bitRecord.append(bits)
-				preFields[fieldie] = fieldie.pseudoLike(cluster)
+				if trace.enabled:
+					t0 = time.time()
+				preFields[fieldie] = fieldie.pseudoLike(clusterSum)
+				if trace.enabled:
+					trace.accumulate("pseudoLike", time.time() - t0)
 	if debbug:
 		assert len(preFields) > 0, "search.fieldPreSampler could not find a medoid."
 		assert len(filter(lambda x: x.isNull() == True, preFields.keys())) < 1, "search.fieldPreSampler returned a null field as a medoid."
@@ -81,7 +108,261 @@ def reduceAreas(fieldDic, maxCombinations, numClusters):
 	selAreas = selAreas[:(listLen + 1)]
 	return selAreas
 
-def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaParameter = 20, progress2stdout = False, pslikeFunc = 'raw', mixture = False, debbug = False):
+def assignObservations(distTable, columns, cohesion):
+	"""
+	Assigns each observation to its closest field among a combination of seed
+	fields, as long as their distance is below `cohesion`. Ties are resolved in
+	favor of the field that comes first in the combination. Returns a list with
+	an array of observation indexes for each field in the combination.
+
+	Arguments:
+
+	- distTable: two-dimensional numpy array of distances between observations
+	(rows) and seed fields (columns), as returned by `data.distTable`.
+
+	- columns: list of column indexes in `distTable` (the seed combination).
+
+	- cohesion (float): maximum distance between an observation and its field.
+	"""
+	sub = distTable[:, columns]
+	nearest = sub.argmin(axis = 1)
+	assigned = sub[numpy.arange(sub.shape[0]), nearest] < min(cohesion, 1.0)
+	return [numpy.flatnonzero(assigned & (nearest == ic)) for ic in xrange(len(columns))]
+
+class CombinationScorer(object):
+	"""
+	Evaluates combinations of seed fields on a fixed set of observations.
+	Observations are assigned to their closest seed in the combination, then
+	each seed is fitted to its observations. Distances between observations and
+	seeds are computed once at instantiation; fitted fields are memoized in a
+	cache.FieldCache (attribute `fitCache`).
+	"""
+	def __init__(self, observations, seeds, clusCohesion, gammaParameter, pslikeFunc = 'raw', mixture = False, cacheSize = 128, debbug = False):
+		self.observations = observations
+		self.seeds = seeds
+		self.seedDists = data.distTable(observations, seeds)
+		self.clusCohesion = clusCohesion
+		self.gammaParameter = gammaParameter
+		self.pslikeFunc = pslikeFunc
+		self.mixture = mixture
+		self.fitCache = cache.FieldCache(cacheSize)
+		self.debbug = debbug
+		return None
+
+	def fit(self, seedIdx, members):
+		"""
+		Fits a field to a subset of observations (array of indexes), starting
+		from a seed field (index). Returns a tuple of the fitted field
+		(data.HMRF) and its pseudolikelihood.
+		"""
+		key = self.fitCache.key(seedIdx, members, len(self.observations))
+		fitted = self.fitCache.get(key)
+		if fitted is None:
+			taxa = (data.sumTiles([self.observations[x] for x in members]), len(members))
+			field = data.HMRF(template = self.seeds[seedIdx], gamma = self.gammaParameter)
+			if trace.enabled:
+				t0 = time.time()
+			field.emea(taxa)
+			if trace.enabled:
+				t1 = time.time()
+				trace.accumulate("emea", t1 - t0)
+			if self.debbug:
+				assert field.isNull() == False, "Expectation-Maximization algorithm resulted in a null field."
+			fitted = (field, field.pseudoLike(taxa, self.pslikeFunc))
+			if trace.enabled:
+				trace.accumulate("pseudoLike", time.time() - t1)
+			self.fitCache.put(key, fitted[0], fitted[1])
+		return fitted
+
+	def score(self, columns):
+		"""
+		Evaluates a combination of seed fields (tuple of seed indexes). Returns
+		a tuple of the total pseudolikelihood, the dictionary of fields to
+		observations, and the dictionary of fields to pseudolikelihoods; or None
+		if any field gets less than two observations.
+		"""
+		pseudolikelihood = 0.0
+		#pseudolikelihoodMixture = 0.0
+		members = assignObservations(self.seedDists, list(columns), self.clusCohesion)
+
+		if min(map(len, members)) < 2:
+			# This optimization iteration does not contain all k clusters required
+			return None
+
+		field2tiles = OrderedDict() # deterministic summation order in modelSel
+		pslikes = {}
+		if self.mixture:
+			for co, mem in zip(columns, members):
+				field2tiles[data.HMRF(template = self.seeds[co], gamma = self.gammaParameter)] = [self.observations[x] for x in mem]
+			pseudolikelihood += modelSel.mixture_prob(field2tiles, self.pslikeFunc)
+		else:
+			for co, mem in zip(columns, members):
+				field, pslike = self.fit(co, mem)
+				field2tiles[field] = [self.observations[x] for x in mem]
+				pslikes[field] = pslike
+				pseudolikelihood += pslike
+
+		return (pseudolikelihood, field2tiles, pslikes)
+
+# Scorer shared with worker processes (set by poolInit)
+poolScorer = None
+
+def poolInit(scorer):
+	global poolScorer
+	# Interruptions are handled by the main process, which terminates the pool
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	poolScorer = scorer
+
+def poolScore(combos):
+	"""
+	Worker process task: returns the pseudolikelihoods of a list of
+	combinations (None for invalid combinations), the hits, misses and
+	evictions of the worker cache during the task, and the trace totals
+	recorded during the task (empty if tracing is disabled).
+	"""
+	out = []
+	before = poolScorer.fitCache.stats()
+	if trace.enabled:
+		trace.totals = {} # the parent process keeps the totals of previous tasks
+	for columns in combos:
+		scored = poolScorer.score(columns)
+		if scored is None:
+			out.append(None)
+		else:
+			out.append(scored[0])
+	after = poolScorer.fitCache.stats()
+	return out, [after[x] - before[x] for x in ("hits", "misses", "evictions")], (trace.totals if trace.enabled else {})
+
+def scoreCombinations(scorer, combos, pool = None, workers = 1, chunkSize = 64):
+	"""
+	Evaluates an iterable of seed combinations (tuples of seed indexes) with a
+	CombinationScorer. Yields tuples (combination, score), in the same order as
+	`combos`, where score is the value returned by `CombinationScorer.score`.
+
+	If a multiprocessing pool is parsed, combinations are evaluated in chunks by
+	`workers` processes. Fields are not sent back from the workers, so the
+	dictionaries in the scores are None; use `CombinationScorer.score` to
+	retrieve them. Cache counters of the workers are added to those of the
+	scorer cache, and their trace totals to those of this process.
+	"""
+	if pool is None:
+		for columns in combos:
+			yield columns, scorer.score(columns)
+	else:
+		combos = iter(combos)
+		pending = deque()
+		exhausted = False
+		while not exhausted or pending:
+			if not exhausted:
+				chunk = list(islice(combos, chunkSize))
+				if chunk:
+					pending.append((chunk, pool.apply_async(poolScore, (chunk,))))
+				else:
+					exhausted = True
+			if pending and (exhausted or len(pending) >= (4 * workers)):
+				chunk, job = pending.popleft()
+				pslikes, counts, totals = job.get(poolTimeout)
+				scorer.fitCache.hits += counts[0]
+				scorer.fitCache.misses += counts[1]
+				scorer.fitCache.evictions += counts[2]
+				trace.merge(totals)
+				for columns, pslike in zip(chunk, pslikes):
+					if pslike is None:
+						yield columns, None
+					else:
+						yield columns, (pslike, None, None)
+
+def beamCandidates(beam, columns, k):
+	"""
+	Returns the combinations of `k` seeds (tuples of seed indexes) obtained by
+	adding a single seed to each partial solution of `k` - 1 seeds in `beam`.
+	Seeds within a combination follow their order in `columns`, and duplicated
+	combinations are removed (the first one generated is kept).
+	"""
+	if k == 1:
+		return [(c,) for c in columns]
+	position = {c:ic for ic,c in enumerate(columns)}
+	candidates = []
+	seen = set()
+	for partial in beam:
+		for c in columns:
+			if c not in partial:
+				cand = tuple(sorted(partial + (c,), key = position.get))
+				if frozenset(cand) not in seen:
+					seen.add(frozenset(cand))
+					candidates.append(cand)
+	return candidates
+
+def annealCombinations(scorer, nseeds, k, steps, rng, start = None, pool = None, workers = 1):
+	"""
+	Simulated annealing over combinations of `k` seeds out of `nseeds`. Moves
+	swap a single seed of the current combination for one outside it, and are
+	accepted according to the change in total pseudolikelihood and a geometric
+	cooling schedule. The temperature is scaled by the mean absolute change of
+	the moves proposed so far, which makes the schedule independent of the
+	magnitude of pseudolikelihoods. Combinations in which a field gets less than
+	two observations are only accepted while the current one is also invalid.
+
+	Yields tuples (combination, score) as `scoreCombinations` does, one per
+	evaluation, until `steps` combinations have been evaluated. Moves are
+	proposed in batches of `workers` combinations, evaluated concurrently if a
+	multiprocessing pool is parsed, and the first accepted move of the batch is
+	taken.
+
+	Arguments:
+
+	- scorer: a CombinationScorer object.
+
+	- nseeds (int): number of seed fields.
+
+	- k (int): number of seeds per combination.
+
+	- steps (int): number of combinations to evaluate (evaluation budget).
+
+	- rng (random.Random): random number generator.
+
+	- start (tuple of ints): initial combination. If None, a random one is used.
+	"""
+	coolest = 1e-3 # final temperature relative to the initial one
+	if start is None:
+		start = rng.sample(xrange(nseeds), k)
+	current = tuple(sorted(start))
+	scored = scorer.score(current)
+	yield current, scored
+	currentPL = None if scored is None else scored[0]
+	evaluated = 1
+	sumDelta, numDelta = 0.0, 0
+
+	while evaluated < steps and k < nseeds:
+		batch = []
+		for b in xrange(min(max(workers, 1), steps - evaluated)):
+			outside = [x for x in xrange(nseeds) if x not in current]
+			move = list(current)
+			move[rng.randrange(k)] = rng.choice(outside)
+			batch.append((tuple(sorted(move)), rng.random()))
+
+		moves = dict(batch)
+		accepted = None
+		for comb, scored in scoreCombinations(scorer, [x[0] for x in batch], pool, workers):
+			evaluated += 1
+			yield comb, scored
+			if accepted is not None:
+				continue
+			if currentPL is None:
+				if scored is not None:
+					accepted = (comb, scored[0])
+			elif scored is not None:
+				delta = scored[0] - currentPL
+				sumDelta += abs(delta)
+				numDelta += 1
+				temperature = (sumDelta / numDelta) * (coolest ** (float(evaluated) / steps))
+				if delta >= 0.0 or (temperature > 0.0 and moves[comb] < exp(delta / temperature)):
+					accepted = (comb, scored[0])
+		if accepted is not None:
+			current, currentPL = accepted
+
+def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaParameter = 20, progress2stdout = False, pslikeFunc = 'raw', mixture = False, cacheSize = 128, workers = 1, strategy = 'exhaustive', beamWidth = 10, annealSteps = 1000, randomSeed = None, timeLimit = None, debbug = False):
 	"""
 	Main function wrapper. Execute model selection and optimize the state path
 	and parameters of each HMRF.
@@ -99,6 +380,46 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 
 	- gammaParameter (int): Potts model gamma parameter. Sets spatial correlation
 	among neighbor cells in the field.
+
+	- cacheSize (int): maximum number of fitted fields (and their
+	pseudolikelihoods) memoized by seed field and observation subset. Cache
+	statistics are returned in the `cacheStats` attribute of the result.
+
+	- workers (int): number of processes evaluating field combinations. Results
+	are identical to those of a single process run.
+
+	- strategy (str, "exhaustive", "beam" or "anneal"): how field combinations
+	are explored in each model selection cycle. "exhaustive" evaluates all
+	combinations of k seed fields. "beam" builds combinations of k fields by
+	adding one seed field to each of the best `beamWidth` combinations of k - 1
+	fields, so evaluations per cycle are at most `beamWidth` times the number of
+	seeds. If no combination of a "beam" cycle is valid (every field needs two
+	observations), later cycles would have no partial solutions to extend, so
+	the search stops there and the record of that cycle in `cycles` gets key
+	"beamExhausted" set to True. "anneal" runs a simulated annealing over
+	combinations of k fields (see `annealCombinations`), starting from the best
+	combination of k - 1 fields plus a random seed, and stops after
+	`annealSteps` evaluations; cycles with fewer combinations than that are
+	evaluated exhaustively.
+	`maxCycleIters` only applies to the "exhaustive" strategy.
+
+	- beamWidth (int): number of partial solutions kept per cycle by the "beam"
+	strategy.
+
+	- annealSteps (int): evaluations per cycle of the "anneal" strategy.
+
+	- randomSeed (int): seed of the random number generator used by the
+	"anneal" strategy. Runs with the same seed and number of workers give
+	identical results.
+
+	- timeLimit (float): maximum search time in seconds. Once exceeded, the
+	search stops after the combination being evaluated and the best result
+	found so far is returned, with its `truncated` attribute set to True. Seed
+	sampling and the refit of the best combination of a cycle are not started
+	once the limit is exceeded. A KeyboardInterrupt (Ctrl-C) during the search
+	has the same effect. If it stops the evaluation of combinations, the best
+	one evaluated is still scored; anywhere else in a cycle, the result of the
+	last complete cycle is returned.
 	"""
 
 	selectedHypo = {}
@@ -106,8 +427,12 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 	aics = []
 	psdlks = []
 	maxAreaNumber = 0
+	deadline = None
 	result = rescon.Ensemble()
 
+	if strategy != 'exhaustive' and strategy != 'beam' and strategy != 'anneal':
+		raise ValueError("Valid values for argument `strategy` are `exhaustive`, `beam`, and `anneal`.")
+
 	# Test basic assumptions of function input
 	if debbug:
 		assert maxCycleIters is None or isinstance(maxCycleIters, int), "{0} is not a valid type for argument `maxCycleIters` in search.fieldOptim.".format(type(maxCycleIters))
@@ -118,11 +443,41 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 		assert len(observations) > 0, "search.fieldOptim function called on no observations."
 		assert len(observations) > 1, "search.fieldOptim function called on a single data.Tile."
 
-	preFields = fieldPreSampler(observations, clusCohesion, debbug)
-	if debbug:
-		print "{0} seed fields".format(len(preFields))
-		#for p in preFields:
-		#	print p
+	if timeLimit is not None:
+		deadline = time.time() + timeLimit
+
+	scorer = None
+	pool = None
+	try:
+		with trace.span("fieldPreSampler", observations = len(observations)) as sp:
+			preFields = fieldPreSampler(observations, clusCohesion, debbug, deadline)
+			sp.set(seeds = len(preFields))
+		if debbug:
+			print "{0} seed fields".format(len(preFields))
+			#for p in preFields:
+			#	print p
+
+		if deadline is None or time.time() <= deadline:
+			# Observation to seed field distances do not change among combinations
+			seeds = preFields.keys()
+			seedIndex = {x:ix for ix,x in enumerate(seeds)}
+			with trace.span("distTable"):
+				scorer = CombinationScorer(observations, seeds, clusCohesion, gammaParameter, pslikeFunc, mixture, cacheSize, debbug = debbug)
+			if workers > 1:
+				pool = Pool(workers, poolInit, (scorer,))
+	except KeyboardInterrupt:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		scorer = None
+	if scorer is None:
+		# Interrupted or out of time before any combination was evaluated
+		result.truncated = True
+		result.noise = list(observations)
+		return result
+	beam = []
+	rng = Random(randomSeed)
+	prevColumns = None
 
 	if progress2stdout:
 		sys.stdout.write("\n")
@@ -135,98 +490,148 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 		maxAreaNumber = len(preFields)
 
 	for k in xrange(1, (maxAreaNumber + 1)):
-		if debbug:
-			print "Assuming {0} components.".format(k)
-		bestCluster = {}
-		bestPseudolikelihood = -1e15
-		plic = 0.0
-		progStep = float()
-		combCounter = 0
-
-		if progress2stdout:
-			backies = 36 + len(str(k)) + len(str(maxAreaNumber))
-			sys.stdout.write("\b" * backies)
-			sys.stdout.flush()
-			sys.stdout.write("Cycle {0} of {1} posible =>  [          ]".format(k, maxAreaNumber))
-			sys.stdout.flush()
-			sys.stdout.write("\b" * 11)
-			sys.stdout.flush()
-
-		if maxCycleIters is None:
-			newAreaSet = preFields.keys()
-		else:
-			newAreaSet = reduceAreas(preFields, maxCycleIters, k)
-
-		progStep = (factorial(len(newAreaSet))/(factorial(k) * factorial(len(newAreaSet) - k))) / 10.0
-		threshold = 0.0
-		leftover = 10
-
-		for comb in combinations(newAreaSet, k):
+		# An interrupt anywhere in a cycle keeps the result of the last
+		# complete one
+		try:
 			if debbug:
-				print "\tCombination",comb
-			combCounter += 1
+				print "Assuming {0} components.".format(k)
+			bestPseudolikelihood = -1e15
+			plic = 0.0
+			progStep = float()
+			combCounter = 0
+
 			if progress2stdout:
-				if combCounter > threshold:
-					sys.stdout.write(".")
-					sys.stdout.flush()
-					threshold += progStep
-					leftover -= 1
-			fields = []
-			pseudolikelihood = 0.0
-			#pseudolikelihoodMixture = 0.0
-			for co in comb:
-				fields.append(data.HMRF(template = co, gamma = gammaParameter))
-			field2tiles = {x:[] for x in fields}
-			for o in observations:
-				bestDist = 1.0
-				papa = None
-				for f in fields:
-					thisDist = data.getDist(o,f)
-					if bestDist > thisDist and thisDist < clusCohesion:
-						bestDist = thisDist
-						papa = f
-				if papa is not None:
-					field2tiles[papa].append(o)
-
-			solitaryFields = filter(lambda x : len(field2tiles[x]) < 2, field2tiles)
-			if len(solitaryFields) > 0:
-				# This optimization iteration does not contain all k clusters required
+				backies = 36 + len(str(k)) + len(str(maxAreaNumber))
+				sys.stdout.write("\b" * backies)
+				sys.stdout.flush()
+				sys.stdout.write("Cycle {0} of {1} posible =>  [          ]".format(k, maxAreaNumber))
+				sys.stdout.flush()
+				sys.stdout.write("\b" * 11)
+				sys.stdout.flush()
+
+			evaluations = None
+			if strategy == 'beam':
+				combos = beamCandidates(beam, range(len(seeds)), k)
+				progStep = len(combos) / 10.0
+			elif strategy == 'anneal':
+				ncombs = factorial(len(seeds))/(factorial(k) * factorial(len(seeds) - k))
+				if ncombs > annealSteps:
+					start = None
+					if prevColumns is not None:
+						start = prevColumns + (rng.choice([x for x in xrange(len(seeds)) if x not in prevColumns]),)
+					evaluations = annealCombinations(scorer, len(seeds), k, annealSteps, rng, start, pool, workers)
+					progStep = annealSteps / 10.0
+				else:
+					combos = combinations(range(len(seeds)), k)
+					progStep = ncombs / 10.0
+			else:
+				if maxCycleIters is None:
+					newAreaSet = preFields.keys()
+				else:
+					newAreaSet = reduceAreas(preFields, maxCycleIters, k)
+				combos = combinations([seedIndex[x] for x in newAreaSet], k)
+				progStep = (factorial(len(newAreaSet))/(factorial(k) * factorial(len(newAreaSet) - k))) / 10.0
+
+			threshold = 0.0
+			leftover = 10
+			bestColumns = None
+			bestScore = None
+			cycleScores = []
+
+			if evaluations is None:
+				evaluations = scoreCombinations(scorer, combos, pool, workers)
+
+			with trace.span("Cycle {0}".format(k), components = k, strategy = strategy) as sp:
+				try:
+					for comb, scored in evaluations:
+						if debbug:
+							print "\tCombination",[seeds[x] for x in comb]
+						combCounter += 1
+						if progress2stdout:
+							if combCounter > threshold:
+								sys.stdout.write(".")
+								sys.stdout.flush()
+								threshold += progStep
+								leftover -= 1
+
+						if scored is not None:
+							pseudolikelihood = scored[0]
+
+							if debbug:
+								print "\tPseudolikelihood: {0}".format(pseudolikelihood)
+
+							if strategy == 'beam':
+								cycleScores.append((pseudolikelihood, comb))
+
+							if bestPseudolikelihood < pseudolikelihood:
+								bestPseudolikelihood = pseudolikelihood
+								bestColumns = comb
+								bestScore = scored
+
+						if deadline is not None and time.time() > deadline:
+							# Time is up: stop after the current combination
+							result.truncated = True
+							break
+				except KeyboardInterrupt:
+					result.truncated = True
+				sp.set(evaluated = combCounter, pseudolikelihood = (bestPseudolikelihood if bestColumns is not None else None))
+
+			if strategy == 'beam':
+				# Sort is stable: ties keep evaluation order
+				beam = [x[1] for x in sorted(cycleScores, key = lambda x: x[0], reverse = True)[:beamWidth]]
+
+			prevColumns = bestColumns
+			result.cycles.append({"components": k, "evaluated": combCounter, "pseudolikelihood": None})
+			if result.truncated and debbug:
+				print "Search truncated after {0} combinations.".format(combCounter)
+
+			# Should this loop be broken if no clusters were found?
+			if bestColumns is None:
+				if result.truncated:
+					break
+				if strategy == 'beam':
+					result.cycles[-1]["beamExhausted"] = True
+					if progress2stdout:
+						sys.stdout.write("\n")
+						sys.stdout.flush()
+					break
 				continue
 
+			if bestScore[1] is None:
+				# Evaluated by a worker process, fields have to be fitted again
+				if deadline is not None and time.time() > deadline:
+					result.truncated = True
+					break
+				bestScore = scorer.score(bestColumns)
+			bestCluster = bestScore[1]
+			bestPslikes = bestScore[2]
+
+			psdlks.append(bestPseudolikelihood)
+			result.cycles[-1]["pseudolikelihood"] = bestPseudolikelihood
+			scores = modelSel.ModelScores(bestCluster, pslikeFunc, pslikes = bestPslikes)
 			if mixture:
-				pseudolikelihood += modelSel.mixture_prob(field2tiles,pslikeFunc)
+				plics.append(scores.plicMixture())
 			else:
-				for f in field2tiles:
-					f.emea(field2tiles[f])
-					if debbug:
-						assert f.isNull() == False, "Expectation-Maximization algorithm resulted in a null field."
-					pseudolikelihood += f.pseudoLike(field2tiles[f],pslikeFunc)
+				plics.append(scores.plic())
+			aics.append(scores.aic()) ### Add AIC using mixtures
 
 			if debbug:
-				print "\tPseudolikelihood: {0}".format(pseudolikelihood)
-
-			if bestPseudolikelihood < pseudolikelihood:
-				bestPseudolikelihood = pseudolikelihood
-				bestCluster = field2tiles
+				#print "\tPseudolikelihood = {0}".format(psdlks[-1])
+				print "\tPLIC = {0}".format(plics[-1])
 
-		# Should this loop be broken if no clusters were found?
-		if bestCluster == {}:
-			continue
+			if (len(plics) > 1 and plics[-1] < plics[-2]): #or (k == maxAreaNumber):
+				if progress2stdout:
+					if leftover > 0:
+						sys.stdout.write("." * leftover)
+						sys.stdout.write("]")
+						sys.stdout.flush()
 
-		psdlks.append(bestPseudolikelihood)
-		if mixture:
-			plics.append(modelSel.plic_mixture(bestCluster, pslikeFunc))
-		else:
-			plics.append(modelSel.plic(bestCluster, pslikeFunc))
-
-		aics.append(modelSel.aic(bestCluster)) ### Add AIC using mixtures
-
-		if debbug:
-			#print "\tPseudolikelihood = {0}".format(psdlks[-1])
-			print "\tPLIC = {0}".format(plics[-1])
+					sys.stdout.write("\n")
+					sys.stdout.flush()
+				if not debbug:
+					break
 
-		if (len(plics) > 1 and plics[-1] < plics[-2]): #or (k == maxAreaNumber):
-			if progress2stdout:
+			if k == maxAreaNumber and progress2stdout:
 				if leftover > 0:
 					sys.stdout.write("." * leftover)
 					sys.stdout.write("]")
@@ -234,24 +639,30 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 
 				sys.stdout.write("\n")
 				sys.stdout.flush()
-			if not debbug:
-				break
 
-		if k == maxAreaNumber and progress2stdout:
-			if leftover > 0:
-				sys.stdout.write("." * leftover)
-				sys.stdout.write("]")
-				sys.stdout.flush()
+			else:
+				result.field2taxa = bestCluster
+				result.aic = aics[-1]
+				result.plic = plics[-1]
+				result.pseudolikelihood = psdlks[-1]
+				result.components = len(bestCluster)
 
-			sys.stdout.write("\n")
-			sys.stdout.flush()
+			if result.truncated:
+				break
+		except KeyboardInterrupt:
+			result.truncated = True
+			break
 
+	if pool is not None:
+		if result.truncated:
+			pool.terminate()
 		else:
-			result.field2taxa = bestCluster
-			result.aic = aics[-1]
-			result.plic = plics[-1]
-			result.pseudolikelihood = psdlks[-1]
-			result.components = len(bestCluster)
+			pool.close()
+		pool.join()
+
+	if result.truncated and progress2stdout:
+		sys.stdout.write("\n")
+		sys.stdout.flush()
 
 	# Retrieve noise
 	for ob in observations:
@@ -263,8 +674,28 @@ def fieldOptim(observations, clusCohesion = 0.3, maxCycleIters = None, gammaPara
 		if isNoise:
 			result.noise.append(ob)
 
+	result.cacheStats = scorer.fitCache.stats()
+
 	return result
 
+def strategyGap(observations, strategy = 'beam', **kwargs):
+	"""
+	Compares a search strategy of `fieldOptim` with the exhaustive search on the
+	same observations. Returns a dictionary with number of components (int) as
+	keys and the difference between the best pseudolikelihoods found by the
+	exhaustive search and by `strategy` as values (0.0 means the strategy found
+	the optimum). Only cycles completed by both searches are reported.
+	Additional keyword arguments are parsed to `fieldOptim`.
+	"""
+	exhaustive = fieldOptim(observations, strategy = 'exhaustive', **kwargs)
+	other = fieldOptim(observations, strategy = strategy, **kwargs)
+	optima = {cy["components"] : cy["pseudolikelihood"] for cy in exhaustive.cycles if cy["pseudolikelihood"] is not None}
+	gap = {}
+	for cy in other.cycles:
+		if cy["pseudolikelihood"] is not None and cy["components"] in optima:
+			gap[cy["components"]] = optima[cy["components"]] - cy["pseudolikelihood"]
+	return gap
+
 def hierarOptim(observations, maxDistance = 0.5, gamma = 20, pseudoLikeFunc = 'pmf', mixture = 'no', debbug = False):
 	"""
 	mixture: 'no' | 'complete' | 'simple'
@@ -320,21 +751,22 @@ def hierarOptim(observations, maxDistance = 0.5, gamma = 20, pseudoLikeFunc = 'p
 		if net_clusters > 0:# gotNullField == False:
 
 			areaCounter.append(len(currentNodes))
+			scores = modelSel.ModelScores(fieldTaxDic, pseudoLikeFunc)
 			if mixture == 'complete':
-				plicValues.append(modelSel.plic_mixture(fieldTaxDic, pslikeplic = pseudoLikeFunc))
+				plicValues.append(scores.plicMixture())
 			elif mixture == 'no':
-				plicValues.append(modelSel.plic(fieldTaxDic, plikefunc = pseudoLikeFunc, ms_debbug = debbug))
+				plicValues.append(scores.plic(debbug = debbug))
 			elif mixture == 'simple':
-				plicValues.append(modelSel.plic_weigthed(fieldTaxDic, pslikeplic = pseudoLikeFunc))
+				plicValues.append(scores.plicWeighted())
 			if debbug:
 				print "PLIC: ",plicValues[-1]
-			aicValues.append(modelSel.aic(fieldTaxDic))
+			aicValues.append(scores.aic())
 			if mixture == 'complete':
-				pseudolikelihood = modelSel.mixture_prob(fieldTaxDic, pslikeFunc = pseudoLikeFunc)
+				pseudolikelihood = scores.mixture()
 			elif mixture == 'no':
-				pseudolikelihood = sum([fi.pseudoLike(fieldTaxDic[fi], distr_form = pseudoLikeFunc) for fi in fieldTaxDic])
+				pseudolikelihood = scores.pseudolikelihood()
 			elif mixture == 'simple':
-				pseudolikelihood = modelSel.weighted_prob(fieldTaxDic, pslikeFunc = pseudoLikeFunc)
+				pseudolikelihood = scores.weighted()
 			pseValues.append(pseudolikelihood)
 			node_maps.append(currentNodes)
 
@@ -23,7 +23,7 @@
 import numpy
 #from data import Tile
 import random
-from data import Tile
+from data import Tile, preferSparse
 
 def getFake(case, clus=2, num=3, datRatio = 1, inun=0.95, exun=0.95, offun=0, noise=0, height=10, width=10, geometry="square"):
 	"""
@@ -386,6 +386,181 @@ def getBigDataset(clus = 30, num = 2, inun=0.95, exun=0.95, noise = 0):
 			outList.append(Tile(ingrid=listmp,cellType='square'))
 	return outList
 
+def randomState(seed = None):
+	"""
+	Returns a numpy.random.RandomState. `seed` can be None, an integer, or a
+	RandomState (returned as is).
+	"""
+	if isinstance(seed, numpy.random.RandomState):
+		return seed
+	return numpy.random.RandomState(seed)
+
+def fakeAreas(case, c, height, width, xoffset, yoffset):
+	"""
+	Returns the areas (list of tuples y0, yf, x0, xf, neighborhood, bounded) of
+	cluster `c` in simulation `case` of `getFake`. Cells within y0--yf and
+	x0--xf belong to the area; cells within `neighborhood` cells of its border
+	are the external region. If bounded is False, the external region extends to
+	the first row and column.
+	"""
+	xs3, xs5 = int(0.3 * width) - 1, int(0.5 * width) - 1
+	ys3, ys5 = int(0.3 * height) - 1, int(0.5 * height) - 1
+	xo, yo = xoffset, yoffset
+	if case == 0:
+		nb = int(ys5 * 0.25)
+		areas = [[(yo, ys5 + yo, xo, xs5 + xo, nb, True)],
+			[(ys5 + 1 - yo, height - 1 - yo, xs5 + 1 - xo, width - 1 - xo, nb, True)],
+			[(ys5 + 1 - yo, height - 1 - yo, xo, xs5 + xo, nb, True)],
+			[(yo, ys5 + yo, xs5 + 1 - xo, width - 1 - xo, nb, True)]]
+	elif case == 1:
+		areas = [[(yo, height - 1 - ys3 + yo, xo, width - 1 - xs3 + xo, int((height - ys3) * 0.25), False)],
+			[(yo, ys5 + yo, xo, xs5 + xo, int(xs5 * 0.25), False)],
+			[(yo, ys3 + yo, xo, xs3 + xo, int(xs3 * 0.25), False)]]
+	elif case == 2:
+		nb = int(ys5 * 0.25)
+		areas = [[(yo, ys5 + yo, xo, xs5 + xo, nb, True)],
+			[(xs3 + yo, ys5 + xs3 + yo, xs3 + xo, xs5 + xs3 + xo, nb, True)],
+			[(ys5 + 1 - yo, height - 1 - yo, xs5 + 1 - xo, width - 1 - xo, nb, True)]]
+	elif case == 3:
+		nb = int(ys5 * 0.25)
+		areas = [[(yo, ys5 - 1 + yo, xo, xs5 - 1 + xo, nb, True), (ys5 + 2 - yo, height - 1 - yo, xs5 + 2 - xo, width - 1 - xo, nb, True)],
+			[(ys5 + 2 - yo, height - 1 - yo, xo, xs5 - 1 + xo, nb, True), (yo, ys5 - 1 + yo, xs5 + 2 - xo, width - 1 - xo, nb, True)],
+			[(yo, yo + ys3, xs3 + xo, xs3 + xo + xs5, nb, True), (ys5 + ys3 - yo, height - 1 - yo, xs3 - xo, xs3 - xo + xs5, nb, True)]]
+	else:
+		raise ValueError("Valid values for argument `case` are 0, 1, 2, and 3.")
+	if c >= len(areas):
+		raise ValueError("Simulation case {0} supports up to {1} clusters.".format(case, len(areas)))
+	return areas[c]
+
+def fakeGrids(case, clus=2, num=3, inun=0.95, exun=0.95, offun=0, noise=0, height=10, width=10, seed=None):
+	"""
+	Array version of `getFake`. Returns simulated distributions as a
+	three-dimensional numpy array of 0/1 values (uint8), with shape
+	(distributions, height, width). Distributions are ordered by cluster, noise
+	distributions (full rows or columns) go last.
+
+	Each lattice is drawn with a single call to the random number generator.
+	Results are reproducible given `seed`, but differ from those of `getFake`
+	under the same global seed.
+
+	Arguments are those of `getFake`, plus:
+
+	- seed (int or numpy.random.RandomState): random seed or generator.
+	"""
+	rng = randomState(seed)
+	if type(num) == int:
+		obs = [num for x in xrange(clus)]
+	else:
+		obs = num
+	total = sum(obs[:clus])
+	grids = numpy.zeros((total + noise, height, width), dtype = numpy.uint8)
+	offsets = (offun * rng.normal(1, 0.2, (total, 2))).astype(int)
+	rows = numpy.arange(height)[:, None]
+	cols = numpy.arange(width)[None, :]
+	it = 0
+	for c, o in zip(xrange(clus), obs):
+		for n in xrange(o):
+			areas = fakeAreas(case, c, height, width, offsets[it, 0], offsets[it, 1])
+			rands = rng.random_sample((len(areas), height, width))
+			for ia, (y0, yf, x0, xf, nb, bounded) in enumerate(areas):
+				inner = (y0 <= rows) & (rows <= yf) & (x0 <= cols) & (cols <= xf)
+				outer = (rows <= (yf + nb)) & (cols <= (xf + nb))
+				if bounded:
+					outer &= ((y0 - nb) <= rows) & ((x0 - nb) <= cols)
+				grids[it] |= (inner & (rands[ia] < inun)) | (~inner & outer & (rands[ia] > exun))
+			it += 1
+	for n in rng.choice(height + width, noise, replace = False):
+		if n < height:
+			grids[it, n, :] = 1
+		else:
+			grids[it, :, n - height] = 1
+		it += 1
+	return grids
+
+def bigGrids(clus = 30, num = 2, inun=0.95, exun=0.95, noise = 0, height = 30, width = 30, areasSize = 5, seed = None):
+	"""
+	Array version of `getBigDataset`, on lattices of any size. Returns
+	simulated distributions as a three-dimensional numpy array of 0/1 values
+	(uint8), with shape (distributions, height, width).
+
+	The lattice is split in blocks of `areasSize` x `areasSize` cells, one per
+	cluster (row-wise). Each distribution fills the block of its cluster, turns
+	off (1 - inun) * areasSize**2 cells within it, and turns on
+	(1 - exun) * areasSize**2 cells on the ring of cells bordering it. Each
+	lattice is drawn with a single call to the random number generator.
+
+	Arguments are those of `getBigDataset`, plus:
+
+	- height, width (int): lattice dimensions.
+
+	- areasSize (int): side of the simulated areas, in cells.
+
+	- seed (int or numpy.random.RandomState): random seed or generator.
+	"""
+	rng = randomState(seed)
+	blocksX = width / areasSize
+	if clus > (height / areasSize) * blocksX:
+		raise ValueError("A {0}x{1} lattice only fits {2} areas of {3}x{3} cells.".format(height, width, (height / areasSize) * blocksX, areasSize))
+	internalCellsOff = int((1-inun) * areasSize**2)
+	externalCellsOn = int((1-exun) * areasSize**2)
+	grids = numpy.zeros((clus * num + noise, height, width), dtype = numpy.uint8)
+	it = 0
+	for c in xrange(clus):
+		y0, x0 = (c / blocksX) * areasSize, (c % blocksX) * areasSize
+		block = numpy.zeros((height, width), dtype = bool)
+		block[y0:(y0 + areasSize), x0:(x0 + areasSize)] = True
+		ring = numpy.zeros((height, width), dtype = bool)
+		ring[max(0, y0 - 1):(y0 + areasSize + 1), max(0, x0 - 1):(x0 + areasSize + 1)] = True
+		inside = numpy.flatnonzero(block)
+		border = numpy.flatnonzero(ring & ~block)
+		for n in xrange(num):
+			rands = rng.random_sample(height * width)
+			flat = grids[it].reshape(-1)
+			flat[inside] = 1
+			flat[inside[numpy.argsort(rands[inside])[:internalCellsOff]]] = 0
+			flat[border[numpy.argsort(rands[border])[:externalCellsOn]]] = 1
+			it += 1
+	for n in rng.choice(height + width, noise, replace = False):
+		if n < height:
+			grids[it, n, :] = 1
+		else:
+			grids[it, :, n - height] = 1
+		it += 1
+	return grids
+
+def gridsToTiles(grids, geometry = "square", narrow = False, sparse = None):
+	"""
+	Returns a list of data.Tile objects from a three-dimensional array of
+	distributions (distributions, rows, columns). Narrow Tiles are views of
+	`grids` if it is a C-contiguous uint8 array, and take no additional memory;
+	`grids` is then made read-only. If `sparse` is None, a distribution gets a
+	sparse Tile if `data.preferSparse` of its number of presence cells.
+	"""
+	grids = numpy.asarray(grids)
+	cells = grids.shape[1] * grids.shape[2]
+	if sparse is None:
+		occupied = (grids == 1).reshape((grids.shape[0], cells)).sum(axis = 1)
+		binary = ((grids == 0) | (grids == 1)).reshape((grids.shape[0], cells)).all(axis = 1)
+		useSparse = [bool(binary[ig]) and preferSparse(occupied[ig], cells) for ig in xrange(grids.shape[0])]
+	else:
+		useSparse = [sparse] * grids.shape[0]
+	tiles = [Tile(ingrid = grids[ig], cellType = geometry, narrow = narrow, sparse = useSparse[ig]) for ig in xrange(grids.shape[0])]
+	if narrow and any(numpy.may_share_memory(numpy.asarray(t), grids) for t in tiles if not t.sparse):
+		grids.flags.writeable = False
+	return tiles
+
+def getFakeFast(case, clus=2, num=3, inun=0.95, exun=0.95, offun=0, noise=0, height=10, width=10, geometry="square", seed=None):
+	"""
+	Same as `fakeGrids`, but returns a list of data.Tile objects.
+	"""
+	return gridsToTiles(fakeGrids(case, clus, num, inun, exun, offun, noise, height, width, seed), geometry)
+
+def getBigDatasetFast(clus = 30, num = 2, inun=0.95, exun=0.95, noise = 0, height = 30, width = 30, areasSize = 5, geometry = "square", seed = None):
+	"""
+	Same as `bigGrids`, but returns a list of data.Tile objects.
+	"""
+	return gridsToTiles(bigGrids(clus, num, inun, exun, noise, height, width, areasSize, seed), geometry)
+
 
 
 #datasets = getMat(5,2)
@@ -21,9 +21,23 @@
 ###############################################################################
 
 import unittest
+import random
+import numpy
+import json
+import os
+import tempfile
+import pickle
+from math import log
+from collections import OrderedDict
 from .. import search
 from .. import sim
 from .. import data
+from .. import hclust
+from .. import cache
+from .. import trace
+from .. import bench
+from .. import infile
+from .. import modelSel
 
 list0 = [[1,1,1,1,1,0,0,0,0,0]] * 5 + [[0 for x in xrange(10)]] * 5
 list1 = [[0 for x in xrange(10)]] * 5 + [[1,1,1,1,1,0,0,0,0,0]] * 5
@@ -48,6 +62,9 @@ class TestDataCase(unittest.TestCase):
 		self.assertTrue(sq0.name == "Nameless_Ghoul", "Tile name could not be set.")
 		self.assertTrue((sq0.cols, sq0.rows) == (10, 10), "Square Tile dimensions are not correct.")
 		self.assertTrue((hex0.cols, hex0.rows) == (10, 10), "Hexagonal Tile dimensions are not correct.")
+		self.assertTrue(sq0.toList() == list0 and sq0.symbols.dtype == numpy.float64, "Tile values differ from those of the list.")
+		with self.assertRaises(ValueError):
+			data.Tile(ingrid = [[0, 1], [1]], cellType = "square")
 
 	def testNeighborhoodSystem(self):
 		"""
@@ -68,6 +85,102 @@ class TestDataCase(unittest.TestCase):
 		self.assertTrue([(4, 0), (4, 1), (6, 0), (6, 1), (5, 1)] == hex0.getNeighs(5,0), "Could not assign neighbors in hexagonal Tile")
 		self.assertTrue([(1, 5), (1, 4), (0, 4), (0, 6)] == hex0.getNeighs(0,5), "Could not assign neighbors in hexagonal Tile")
 
+	def testSharedNeighbors(self):
+		"""
+		Lattices of the same grid share a single read-only neighbor table?
+		"""
+		hex0 = data.Tile(ingrid = list0, cellType = "hexagon")
+		hex1 = data.Tile(template = hex0)
+		field = data.HMRF(template = hex0)
+		table = data.neighborTable(10, 10, "hexagon")
+		self.assertTrue(table is data.neighborTable(10, 10, "hexagon"), "Neighbor tables are not cached.")
+		self.assertFalse(table.flags.writeable, "Neighbor table can be modified.")
+		self.assertTrue(table.tolist() == hex0.getNeighsAll() == hex1.getNeighsAll() == field.getNeighsAll(), "Tiles do not use the shared neighbor table.")
+		self.assertTrue(data.neighborTable(10, 10, "square").shape == (10, 10, 4, 2), "Wrong dimensions of square neighbor table.")
+
+	def testArrayInterface(self):
+		"""
+		Tiles share float64 buffers and expose read-only views of their values?
+		"""
+		grid = numpy.array(list0, dtype = float)
+		sq0 = data.Tile(ingrid = grid, cellType = "square")
+		sq0.set(0, 0, 1.0)
+		self.assertTrue(grid[0, 0] == 1.0 and numpy.shares_memory(numpy.asarray(sq0), grid), "Tile copied a float64 C-contiguous array.")
+		sq2 = data.Tile(ingrid = list2, cellType = "square")
+		dist = data.getDist(sq0, sq2)
+		with self.assertRaises(ValueError):
+			grid[0, 1] = 1.0 - grid[0, 1]
+		self.assertTrue(data.getDist(sq0, sq2) == dist == data.getDist(data.Tile(ingrid = sq0.toList(), cellType = "square"), sq2), "Source array of a Tile could be modified.")
+		stack = numpy.array([list0, list1], dtype = numpy.uint8)
+		source = stack[1]
+		narrow = data.Tile(ingrid = source, cellType = "square", narrow = True)
+		with self.assertRaises(ValueError):
+			source[0, 0] = 1
+		self.assertTrue(numpy.shares_memory(numpy.asarray(narrow), stack) and narrow.occupancy == sum(map(sum, list1)), "Source array of a Tile could be modified.")
+		other = data.Tile(ingrid = stack[0], cellType = "square", narrow = True)
+		self.assertTrue(numpy.shares_memory(numpy.asarray(other), stack) and stack.flags.writeable, "Tile locked or stopped sharing the array its source is a view of.")
+		narrow.set(0, 0, 1)
+		self.assertTrue(stack[1, 0, 0] == 1 and narrow.occupancy == sum(map(sum, list1)) + 1, "Tile cannot modify its shared array.")
+		sq1 = data.Tile(ingrid = numpy.array(list0, dtype = numpy.uint8), cellType = "square")
+		self.assertTrue(sq1.toList() == list0 and sq1.symbols.dtype == numpy.float64, "Tile could not be created from an integer array.")
+		self.assertFalse(sq1.symbols.flags.writeable or numpy.asarray(sq1).flags.writeable, "Tile values can be modified through a view.")
+		field = data.HMRF(template = sq1)
+		field.emea([sq1])
+		self.assertTrue(field.posteriors.tolist() == field.getPostProbs(), "Posterior view does not match posterior probabilities.")
+
+	def testNarrowStorage(self):
+		"""
+		Narrow Tiles and fields agree with double precision ones?
+		"""
+		grids = sim.fakeGrids(0, 4, 3, 0.9, 0.9, 0, 0, 20, 20, 7)
+		wide = sim.gridsToTiles(grids)
+		narrow = sim.gridsToTiles(grids, narrow = True)
+		self.assertTrue(all(t.narrow and t.symbols.dtype == numpy.uint8 and numpy.shares_memory(numpy.asarray(t), grids[it]) for it, t in enumerate(narrow)), "Narrow Tile did not share a uint8 array.")
+		self.assertFalse(grids.flags.writeable, "Array shared with narrow Tiles is writable.")
+		self.assertTrue(data.getDist(wide[0], wide[5]) == data.getDist(narrow[0], narrow[5]), "Distance between narrow Tiles differs.")
+		self.assertTrue(narrow[1].toList() == wide[1].toList() and pickle.loads(pickle.dumps(narrow[1])).narrow, "Narrow Tile values or storage were not preserved.")
+		with self.assertRaises(ValueError):
+			narrow[0].set(0, 0, 0.5)
+		fieldW = data.HMRF(template = wide[0])
+		fieldN = data.HMRF(template = narrow[0])
+		self.assertTrue(fieldN.narrow and fieldN.posteriors.dtype == numpy.float32, "Field did not inherit narrow storage.")
+		for it in xrange(2):
+			fieldW.emea(wide[:3])
+			fieldN.emea(narrow[:3])
+		self.assertTrue(numpy.array_equal(numpy.asarray(fieldW), numpy.asarray(fieldN)), "Narrow field labels differ.")
+		self.assertTrue(numpy.allclose(fieldW.means, fieldN.means, rtol = 1e-5, atol = 1e-6) and numpy.allclose(fieldW.staDevs, fieldN.staDevs, rtol = 1e-5, atol = 1e-6), "Narrow field parameters differ.")
+		self.assertTrue(numpy.allclose(fieldW.posteriors, fieldN.posteriors, atol = 1e-6), "Narrow posterior probabilities differ.")
+		self.assertAlmostEqual(fieldW.pseudoLike(wide[:3]) / fieldN.pseudoLike(narrow[:3]), 1.0, places = 4, msg = "Narrow pseudolikelihood differs.")
+
+	def testSparseStorage(self):
+		"""
+		Sparse Tiles agree with dense ones?
+		"""
+		grids = numpy.zeros((3, 40, 40), dtype = numpy.uint8)
+		grids[0, 2:5, 3:7] = 1
+		grids[1, 3:6, 5:9] = 1
+		grids[2, :, :] = numpy.arange(1600).reshape((40, 40)) % 3 == 0
+		dense = sim.gridsToTiles(grids, sparse = False)
+		tiles = sim.gridsToTiles(grids)
+		self.assertEqual([ti.sparse for ti in tiles], [True, True, False], "Sparse storage was not chosen by occupancy.")
+		self.assertTrue(all([tiles[ix].toList() == dense[ix].toList() and tiles[ix].toBits() == dense[ix].toBits() for ix in xrange(3)]), "Sparse Tile values differ.")
+		for ia, ib in [(0, 1), (0, 2), (2, 1)]:
+			self.assertEqual(data.getDist(tiles[ia], tiles[ib]), data.getDist(dense[ia], dense[ib]), "Distance between sparse Tiles differs.")
+		self.assertTrue(numpy.array_equal(data.sumTiles(tiles), data.sumTiles(dense)) and numpy.allclose(data.distMatrix(tiles), data.distMatrix(dense)), "Sparse Tile sums or distances differ.")
+		pickled = pickle.dumps(tiles[0], 2)
+		copy = pickle.loads(pickled)
+		self.assertTrue(copy.sparse and copy.toList() == dense[0].toList() and copy.name == tiles[0].name, "Sparse Tile values or storage were not preserved.")
+		self.assertTrue(len(pickled) < len(pickle.dumps(dense[0], 2)) / 4, "Sparse Tile was pickled as a lattice.")
+		copy.set(2, 3, 0)
+		copy.set(0, 0, 1)
+		self.assertTrue(copy.occupancy == 12 and copy[0, 0] == 1 and copy[2, 3] == 0 and not tiles[0].isNull(), "Sparse Tile cells were not set.")
+		with self.assertRaises(ValueError):
+			copy.set(0, 0, 0.5)
+		cells = numpy.flatnonzero(grids[1])
+		self.assertEqual(data.occurrenceTile(cells[::-1], 40, 40).toList(), dense[1].toList(), "Occurrence Tile values differ.")
+		field = data.HMRF(template = tiles[0])
+		self.assertTrue(not field.sparse and field.toList() == dense[0].toList(), "Field did not get dense storage.")
+
 	def testString(self):
 		sqst = "1-1-1-1-1-0-0-0-0-0\n1-1-1-1-1-0-0-0-0-0\n1-1-1-1-1-0-0-0-0-0\n1-1-1-1-1-0-0-0-0-0\n1-1-1-1-1-0-0-0-0-0\n0-0-0-0-0-0-0-0-0-0\n0-0-0-0-0-0-0-0-0-0\n0-0-0-0-0-0-0-0-0-0\n0-0-0-0-0-0-0-0-0-0\n0-0-0-0-0-0-0-0-0-0\n"
 
@@ -185,6 +298,37 @@ class TestDataCase(unittest.TestCase):
 		self.assertTrue(data.getDist(sq0, sq1) == 1.0, "Kulczynski distance function fails.")
 		self.assertTrue(data.getDist(sq0, sq2) == 0.0, "Kulczynski distance function fails.")
 
+	def testBitPackedDistance(self):
+		rnd = random.Random(7)
+		grids = [[[rnd.randint(0,1) for x in xrange(17)] for y in xrange(13)] for z in xrange(2)]
+		ta = data.Tile(ingrid = grids[0], cellType = "square")
+		tb = data.Tile(ingrid = grids[1], cellType = "square")
+		countA = sum(map(sum, grids[0]))
+		countB = sum(map(sum, grids[1]))
+		shared = sum([grids[0][y][x] * grids[1][y][x] for y in xrange(13) for x in xrange(17)])
+		self.assertTrue(ta.occupancy == countA, "Tile occupancy count fails.")
+		self.assertTrue(data.getDist(ta, tb) == (1.0 - (0.5 * ((float(shared) / countA) + (float(shared) / countB)))), "Bit-packed Kulczynski distance fails.")
+		for ir in xrange(13):
+			for ic in xrange(17):
+				tb.set(ir, ic, 0)
+		self.assertTrue(tb.isNull(), "Bit-packed presence is not refreshed after modifying a Tile.")
+		tb.set(12, 16, 1)
+		self.assertTrue(tb.occupancy == 1, "Bit-packed presence is not refreshed after modifying a Tile.")
+
+	def testDistMatrix(self):
+		dat = sim.getFake(2, num=3, clus=3, inun=0.8, exun=0.8, noise=2)
+		mat = data.distMatrix(dat)
+		self.assertTrue(mat.shape == (len(dat), len(dat)), "Batched distance matrix has wrong dimensions.")
+		for ia, ta in enumerate(dat):
+			for ib, tb in enumerate(dat):
+				self.assertTrue(mat[ia, ib] == data.getDist(ta, tb), "Batched Kulczynski distance matrix fails.")
+		table = data.distTable(dat, dat[:3])
+		self.assertTrue(table.shape == (len(dat), 3), "Batched distance table has wrong dimensions.")
+		self.assertTrue((table == mat[:, :3]).all(), "Batched Kulczynski distance table fails.")
+		cond = data.distCondensed(dat)
+		self.assertTrue(cond.shape == ((len(dat) * (len(dat) - 1)) / 2,), "Condensed distance matrix has wrong dimensions.")
+		self.assertTrue((cond == mat[numpy.triu_indices(len(dat), 1)]).all(), "Condensed Kulczynski distance matrix fails.")
+
 	def testEM(self):
 		st0 = data.Tile(ingrid = list0, cellType = "square")
 		st1 = data.Tile(ingrid = list1, cellType = "square")
@@ -198,6 +342,65 @@ class TestDataCase(unittest.TestCase):
 		hf0.emea(ht1)
 		self.assertTrue(hf0.toList() == ht1.toList(), "EM algorithm fails in hexagonal tiles.")
 
+	def testStackedObservations(self):
+		grids = sim.fakeGrids(0, 2, 4, 0.9, 0.9, 0, 0, 12, 12, 5)
+		tiles = sim.gridsToTiles(grids, geometry = "hexagon")
+		forms = [tiles, grids, grids.astype(float), (data.sumTiles(tiles), len(tiles))]
+		results = []
+		for obs in forms:
+			field = data.HMRF(template = tiles[0])
+			field.emea(obs)
+			results.append((field.toList(), list(field.means), list(field.staDevs), field.pseudoLike(obs)))
+		self.assertTrue(all([res == results[0] for res in results]), "Stacked observations and sums give different results than lists of Tiles.")
+		self.assertTrue(numpy.array_equal(data.sumTiles(tiles), grids.sum(axis = 0)), "Wrong sum of Tiles.")
+		with self.assertRaises(TypeError):
+			data.HMRF(template = tiles[0]).emea([1, 2])
+
+	def testColoredUpdate(self):
+		colors = {"square": lambda ir, ic: (ir + ic) % 2, "hexagon": lambda ir, ic: (ic + 2 * (ir % 2)) % 3}
+		for geom in colors:
+			table = data.neighborTable(9, 8, geom)
+			self.assertTrue(all([colors[geom](ir, ic) != colors[geom](y, x) for ir in xrange(9) for ic in xrange(8) for y, x in table[ir, ic] if y >= 0]), "Neighbor cells share a color class.")
+			tiles = sim.gridsToTiles(sim.fakeGrids(0, 4, 3, 0.8, 0.8, 0, 0, 120, 120, 5), geom)
+			labels = []
+			for threads in (0, 1, 3):
+				field = data.HMRF(template = tiles[0])
+				field.emea(tiles[:3], threads = threads)
+				labels.append(numpy.asarray(field))
+			self.assertTrue(numpy.array_equal(labels[1], labels[2]), "Parallel update depends on the number of threads.")
+			self.assertTrue((labels[0] != labels[1]).mean() < 0.015, "Parallel update differs from the serial one.")
+
+	def testIterativeEmea(self):
+		tiles = sim.gridsToTiles(sim.fakeGrids(0, 4, 3, 0.85, 0.85, 0, 0, 30, 30, 11), "square")
+		cells = 30 * 30
+		field = data.HMRF(template = tiles[0])
+		field.emea(tiles[:3])
+		self.assertEqual((field.iterations, field.evaluated), (1, 2 * cells), "HMRF.emea default mode changed.")
+		field = data.HMRF(template = tiles[0])
+		field.emea(tiles[:3], maxIter = 50, tolerance = 1e-6)
+		self.assertTrue(1 <= field.iterations < 50, "HMRF.emea does not converge.")
+		self.assertTrue(field.evaluated >= (field.iterations + 1) * cells, "HMRF.emea skips full sweeps.")
+		labels = numpy.asarray(field).copy()
+		field.emea(tiles[:3], maxIter = 50, tolerance = 1e-6)
+		self.assertEqual((field.iterations, field.flips), (1, 0), "HMRF.emea stops before a fixed point.")
+		self.assertTrue(numpy.array_equal(labels, numpy.asarray(field)), "HMRF.emea stops before a fixed point.")
+		field = data.HMRF(template = tiles[0])
+		field.emea(tiles[:3], tolerance = 1e-6)
+		self.assertTrue(field.iterations > 1 and numpy.array_equal(labels, numpy.asarray(field)), "HMRF.emea tolerance has no effect without maxIter.")
+
+	def testPriorTables(self):
+		tiles = sim.gridsToTiles(sim.fakeGrids(0, 4, 3, 0.85, 0.85, 0, 0, 30, 30, 11), "hexagon")
+		pslikes = []
+		for gamma in (0.2, 400.0):
+			field = data.HMRF(template = tiles[0], gamma = gamma)
+			field.emea(tiles[:3])
+			pslikes.append(field.pseudoLike(tiles[:3]))
+			self.assertTrue(numpy.isfinite(list(field.means) + list(field.staDevs) + [pslikes[-1]]).all(), "HMRF prior overflows.")
+		field = data.HMRF(template = tiles[0])
+		field.setGamma(400.0)
+		field.emea(tiles[:3])
+		self.assertEqual(field.pseudoLike(tiles[:3]), pslikes[1], "HMRF.setGamma does not update prior tables.")
+
 class TestSearchCase(unittest.TestCase):
 	"""
 	Testing search module.
@@ -220,6 +423,39 @@ class TestSearchCase(unittest.TestCase):
 		realOut = search.reduceAreas(dicto, 10, 3)
 		self.assertTrue(suppOut == realOut, "Field reducer function fails (search.reduceAreas).")
 
+	def testDistTree(self):
+		dat = sim.getFake(2, num=3, clus=3, inun=0.8, exun=0.8, noise=2)
+		cond = hclust.dist_matrix(dat, data.getDist)
+		slow = hclust.dist_matrix(dat, lambda a, b: data.getDist(a, b))
+		self.assertTrue(cond.shape == ((len(dat) * (len(dat) - 1)) / 2,), "Condensed distance matrix has wrong dimensions (hclust.dist_matrix).")
+		self.assertTrue((cond == slow).all(), "Condensed distance matrix fails (hclust.dist_matrix).")
+		tree = hclust.dist_tree(cond)
+		self.assertTrue(tree.root == (2 * len(dat)) - 2, "Tree could not be built from a condensed distance matrix (hclust.dist_tree).")
+		self.assertTrue(sorted(tree.get_tips(tree.root)) == range(len(dat)), "Tree could not be built from a condensed distance matrix (hclust.dist_tree).")
+
+	def testAssignObservations(self):
+		dat = sim.getFake(2, num=3, clus=3, inun=0.8, exun=0.8, noise=2)
+		seeds = dat[::3]
+		table = data.distTable(dat, seeds)
+		members = search.assignObservations(table, [2, 0], 0.6)
+		for io, o in enumerate(dat):
+			bestDist, papa = 1.0, None
+			for ic, f in enumerate([seeds[2], seeds[0]]):
+				if bestDist > data.getDist(o, f) and data.getDist(o, f) < 0.6:
+					bestDist, papa = data.getDist(o, f), ic
+			for ic in xrange(2):
+				self.assertTrue((io in members[ic]) == (papa == ic), "Observations could not be assigned to their closest field (search.assignObservations).")
+
+	def testFieldCache(self):
+		fc = cache.FieldCache(2)
+		keys = [fc.key(x, numpy.array([0, x + 1]), 10) for x in xrange(3)]
+		self.assertTrue(fc.get(keys[0]) is None, "Field cache returned a missing entry.")
+		for x in xrange(3):
+			fc.put(keys[x], x, float(x))
+		self.assertTrue(fc.get(keys[0]) is None, "Field cache did not evict the least recently used entry.")
+		self.assertTrue(fc.get(keys[2]) == (2, 2.0), "Field cache could not retrieve a stored entry.")
+		self.assertTrue(fc.stats() == {"hits": 1, "misses": 2, "evictions": 1, "size": 2}, "Field cache statistics are not correct.")
+
 	def testFieldOptim(self):
 		dat = sim.getFake(0, num=3, clus=3, exun=1, inun=1, noise=2)
 		res = search.fieldOptim(dat)
@@ -232,6 +468,226 @@ class TestSearchCase(unittest.TestCase):
 				self.assertTrue(fie.toBits() == ele.toBits(), "Distributions could not be clustered to their parent area during field optimization.")
 		#self.assertTrue(0 == 1, "Testing the test module.")
 
+	def testBeamSearch(self):
+		for case in xrange(4):
+			dat = sim.getFake(case, num=3, clus=3, exun=0.9, inun=0.9, noise=2)
+			gap = search.strategyGap(dat, 'beam', beamWidth = 1)
+			self.assertTrue(len(gap) > 0 and min(gap.values()) >= 0.0, "Beam search cannot be compared with exhaustive search (search.strategyGap).")
+		dat = sim.getFake(0, num=3, clus=3, exun=1, inun=1, noise=2)
+		res = search.fieldOptim(dat, strategy = 'beam', beamWidth = 5)
+		self.assertTrue(res.components == 3, "Correct number of components could not be estimated by beam search.")
+		self.assertTrue(set(search.strategyGap(dat, 'beam', beamWidth = 5).values()) == set([0.0]), "Beam search could not find the optimal combinations.")
+		# No valid combination of two fields: the beam comes out empty
+		score = search.CombinationScorer.score
+		search.CombinationScorer.score = lambda scorer, columns: None if len(columns) == 2 else score(scorer, columns)
+		try:
+			beam = search.fieldOptim(dat, strategy = 'beam', beamWidth = 5)
+			exhaustive = search.fieldOptim(dat)
+		finally:
+			search.CombinationScorer.score = score
+		self.assertTrue(beam.cycles[-1]["components"] == 2 and beam.cycles[-1].get("beamExhausted") and beam.components == 1, "Beam search did not stop on an empty beam.")
+		self.assertTrue(len(exhaustive.cycles) > 2 and "beamExhausted" not in exhaustive.cycles[1], "Exhaustive search stopped on invalid combinations.")
+
+	def testAnnealSearch(self):
+		dat = sim.getBigDataset(clus=8, num=2, inun=0.9, exun=0.9)
+		first = search.fieldOptim(dat, strategy = 'anneal', annealSteps = 20, randomSeed = 3)
+		second = search.fieldOptim(dat, strategy = 'anneal', annealSteps = 20, randomSeed = 3)
+		self.assertTrue((first.plic, first.pseudolikelihood) == (second.plic, second.pseudolikelihood), "Simulated annealing runs with the same seed are not reproducible.")
+		self.assertTrue(max([cyc["evaluated"] for cyc in first.cycles]) == 20, "Simulated annealing did not respect its evaluation budget.")
+		gap = search.strategyGap(dat, 'anneal', annealSteps = 20, randomSeed = 3)
+		self.assertTrue(len(gap) > 0 and min(gap.values()) >= 0.0, "Simulated annealing cannot be compared with exhaustive search (search.strategyGap).")
+
+	def testModelScores(self):
+		dat = sim.getFakeFast(0, clus = 2, num = 3, inun = 0.9, exun = 0.9, seed = 4)
+		dic = OrderedDict()
+		for ic in xrange(2):
+			field = data.HMRF(template = dat[3 * ic])
+			field.emea(dat[3 * ic : 3 * ic + 3])
+			dic[field] = dat[3 * ic : 3 * ic + 3]
+		scores = modelSel.ModelScores(dic, 'raw')
+		self.assertTrue(scores.plic() == modelSel.plic(dic, 'raw') and scores.aic() == modelSel.aic(dic), "Scores differ from module functions.")
+		self.assertTrue(len(scores.terms) == 2, "Raw pseudolikelihoods were not shared between PLIC and AIC.")
+		self.assertTrue(scores.plicWeighted() == modelSel.plic_weigthed(dic) and scores.plicMixture() == modelSel.plic_mixture(dic), "Weighted or mixture scores differ from module functions.")
+		self.assertTrue(scores.pseudolikelihood() == sum([fi.pseudoLike(dic[fi]) for fi in dic]), "Wrong total pseudolikelihood.")
+		given = modelSel.ModelScores(dic, 'pmf', pslikes = {fi: 0.0 for fi in dic})
+		self.assertTrue(given.plic() == -log(given.N) * given.numpars, "Parsed pseudolikelihoods were not used.")
+
+	def testFieldOptimTimeLimit(self):
+		dat = sim.getFake(0, num=3, clus=3, exun=1, inun=1, noise=2)
+		res = search.fieldOptim(dat, timeLimit = 0.0)
+		self.assertTrue(res.truncated, "Field optimization did not stop when its time limit expired.")
+		self.assertTrue(res.cycles == [] and len(res.noise) == len(dat), "Truncated field optimization did not return the best result found so far.")
+		self.assertEqual(len(search.fieldPreSampler(dat, 0.3, deadline = 0.0)), 0, "Seed sampling did not stop when its time limit expired.")
+		# Time runs out while the first combination is scored: it still counts
+		clock = [0.0]
+		score, clockModule = search.CombinationScorer.score, search.time
+		def lateScore(scorer, columns):
+			clock[0] = 2.0
+			return score(scorer, columns)
+		search.CombinationScorer.score = lateScore
+		search.time = type("Clock", (), {"time": staticmethod(lambda: clock[0])})
+		try:
+			res = search.fieldOptim(dat, timeLimit = 1.0)
+		finally:
+			search.CombinationScorer.score, search.time = score, clockModule
+		self.assertTrue(res.truncated and res.cycles[0]["evaluated"] == 1 and res.components == 1, "Combination evaluated when the time limit expired was discarded.")
+		# Interrupted while scoring the model of the second cycle
+		modelScores = search.modelSel.ModelScores
+		def interrupted(cluster, *args, **kwargs):
+			if len(cluster) == 2:
+				raise KeyboardInterrupt
+			return modelScores(cluster, *args, **kwargs)
+		search.modelSel.ModelScores = interrupted
+		try:
+			res = search.fieldOptim(dat)
+		finally:
+			search.modelSel.ModelScores = modelScores
+		self.assertTrue(res.truncated and len(res.cycles) == 2 and res.components == 1, "Interrupted field optimization did not return the last complete cycle.")
+		res = search.fieldOptim(dat, timeLimit = 3600.0)
+		self.assertFalse(res.truncated, "Field optimization was truncated before its time limit expired.")
+		self.assertTrue(res.components == 3, "Correct number of components in time-limited field optimization could not be estimated.")
+
+	def testFieldOptimWorkers(self):
+		dat = sim.getFake(2, num=3, clus=3, exun=0.9, inun=0.9, noise=2)
+		serial = search.fieldOptim(dat)
+		parallel = search.fieldOptim(dat, workers = 2)
+		self.assertTrue((serial.plic, serial.aic, serial.pseudolikelihood) == (parallel.plic, parallel.aic, parallel.pseudolikelihood), "Parallel field optimization does not match the serial run.")
+		self.assertTrue(sorted([fie.toBits() for fie in serial.field2taxa]) == sorted([fie.toBits() for fie in parallel.field2taxa]), "Parallel field optimization does not match the serial run.")
+
+	def testTrace(self):
+		self.assertTrue(trace.span("disabled") is trace.nullSpan, "Spans are recorded while tracing is disabled.")
+		dat = sim.getFake(0, num=3, clus=3, exun=1, inun=1, noise=2)
+		trace.start()
+		try:
+			res = search.fieldOptim(dat)
+			handle, path = tempfile.mkstemp(suffix = ".json")
+			os.close(handle)
+			trace.write(path)
+		finally:
+			trace.stop()
+		with open(path) as fh:
+			events = json.load(fh)["traceEvents"]
+		os.remove(path)
+		names = [ev["name"] for ev in events if ev["ph"] == "X"]
+		self.assertTrue("fieldPreSampler" in names and "emea" in names and "pseudoLike" in names, "Field optimization phases were not traced.")
+		self.assertTrue(len([x for x in names if x.startswith("Cycle")]) == len(res.cycles), "Model selection cycles were not traced.")
+
+	def testFastSimulators(self):
+		for case in xrange(4):
+			grids = sim.fakeGrids(case, clus=3, num=2, inun=1, exun=1, noise=2, height=12, width=12, seed=5)
+			tiles = sim.getFake(case, clus=3, num=2, inun=1, exun=1, height=12, width=12)
+			self.assertTrue(all([numpy.array_equal(numpy.array(ti.toList()), gr) for ti, gr in zip(tiles, grids)]), "Vectorized simulation does not match sim.getFake.")
+			self.assertTrue(numpy.array_equal(grids, sim.fakeGrids(case, clus=3, num=2, inun=1, exun=1, noise=2, height=12, width=12, seed=5)), "Vectorized simulation is not reproducible.")
+		grids = sim.bigGrids(clus=6, num=3, inun=0.8, exun=0.8, noise=1, height=10, width=17, areasSize=5, seed=numpy.random.RandomState(2))
+		self.assertTrue(grids.shape == (19, 10, 17) and list(grids.sum(axis=(1,2))[:-1]) == [25] * 18, "Vectorized big dataset has wrong dimensions or cell counts.")
+		tiles = sim.getBigDatasetFast(clus=2, num=2, height=5, width=10, geometry="hexagon", seed=2)
+		self.assertTrue(tiles[0].toList() == data.Tile(ingrid = tiles[0].toList(), cellType = "hexagon").toList(), "Tile could not be built from an array.")
+		self.assertTrue(tiles[0].getNeighsAll() == data.Tile(ingrid = tiles[0].toList(), cellType = "hexagon").getNeighsAll(), "Tile could not be built from an array.")
+
+
+class TestBenchCase(unittest.TestCase):
+	"""
+	Testing the benchmark harness.
+	"""
+	def testBenchmarks(self):
+		bench.suites["tiny"] = [(["getDist", "emea"], bench.Dataset("fake", 6, 6, 4))]
+		try:
+			report = bench.run("tiny", repeat = 1)
+		finally:
+			del bench.suites["tiny"]
+		self.assertTrue(report["meta"]["suite"] == "tiny" and [x["benchmark"] for x in report["results"]] == ["getDist", "emea"], "Benchmark suite could not be run.")
+		self.assertTrue(all(["error" not in x and x["seconds"] <= x["median"] and (x["memoryKB"] is None or x["memoryKB"] >= 0) for x in report["results"]]), "Benchmark measurements are incomplete.")
+		self.assertTrue(bench.Dataset("fake", 12, 12, 10).generate(3)[0].toBits() == bench.Dataset("fake", 12, 12, 10).generate(3)[0].toBits(), "Benchmark datasets are not reproducible.")
+
+	def testCompare(self):
+		baseline = {"results": [{"benchmark": "getDist", "dataset": "fake", "seconds": 1.0, "memoryKB": 2048},
+			{"benchmark": "emea", "dataset": "fake", "seconds": 1.0, "memoryKB": 2048},
+			{"benchmark": "pseudoLike", "dataset": "fake", "seconds": 1.0, "memoryKB": 100}]}
+		current = {"results": [{"benchmark": "getDist", "dataset": "fake", "seconds": 2.0, "memoryKB": 2048},
+			{"benchmark": "emea", "dataset": "fake", "seconds": 1.0, "memoryKB": 4096},
+			{"benchmark": "pseudoLike", "dataset": "fake", "seconds": 1.1, "memoryKB": 1000},
+			{"benchmark": "fieldOptim", "dataset": "fake", "seconds": 1.0, "memoryKB": 2048}]}
+		self.assertFalse(any([x["regression"] for x in bench.compare(baseline, baseline)]), "Benchmark comparison flagged identical results as regressions.")
+		rows = bench.compare(baseline, current)
+		self.assertTrue([x["benchmark"] for x in rows] == ["getDist", "emea", "pseudoLike"], "Benchmark comparison did not match cases.")
+		self.assertTrue([x["regression"] for x in rows] == [True, True, False] and rows[2]["memoryRatio"] is None, "Benchmark comparison missed or invented regressions.")
+		current["results"][0] = {"benchmark": "getDist", "dataset": "fake", "error": "MemoryError()"}
+		self.assertTrue(bench.compare(baseline, current)[0]["regression"], "Benchmark comparison missed a failed case.")
+
+
+class TestInputCase(unittest.TestCase):
+	"""
+	Testing input file processing.
+	"""
+	def writeCsv(self, lines):
+		handle, path = tempfile.mkstemp(suffix = ".csv")
+		with os.fdopen(handle, "w") as fh:
+			fh.write("\n".join(lines) + "\n")
+		return path
+
+	def testCsvParsing(self):
+		records = ["Sp_{0},{1},{2}".format(x % 7, -70 - (x % 11) * 0.5, 5 - (x % 13) * 0.25) for x in xrange(200)]
+		path = self.writeCsv(["Taxon,Latitude,Longitude"] + [",".join([x.split(",")[0], x.split(",")[2], "' " + x.split(",")[1] + "'"]) for x in records])
+		try:
+			for chunk in (1, 7, 100000):
+				indata = infile.InputData(path, chunkSize = chunk)
+				self.assertTrue(indata.getStats() == (7, len(set(records))), "Records were not parsed correctly (chunk size {0}).".format(chunk))
+				self.assertTrue((indata.minLongitude, indata.maxLongitude, indata.minLatitude, indata.maxLatitude) == (-75.0, -70.0, 2.0, 5.0), "Coordinate bounds were not recorded.")
+				expected = set([(float(x.split(",")[1]), float(x.split(",")[2])) for x in records if x.startswith("Sp_3,")])
+				self.assertTrue(set(indata.points["Sp_3"]) == expected, "Points of a taxon were not stored.")
+				lons, lats = indata.taxonRecords(indata.taxa.index("Sp_3"))
+				self.assertTrue(set(zip(lons.tolist(), lats.tolist())) == expected and len(lons) == len(expected), "Records of a taxon were not stored once.")
+				self.assertTrue(indata.taxa == sorted(indata.taxa) and indata.taxonCodes.dtype == numpy.int32 and indata.longitudes.dtype == numpy.float64, "Record arrays do not follow the expected layout.")
+		finally:
+			os.remove(path)
+		errors = [("Sp_1,1,95", "Line 4 in `{0}` contains invalid coordinate value(s): `95`."),
+			("Sp_1,,5", "Line 4 in `{0}` do not contain longitude data."),
+			("Sp_1,1x,5", "Line 4 in `{0}` contains invalid coordinate value(s): `1x`."),
+			("Sp_1,1,5,0", "Line 4 in `{0}` contains more than three columns.")]
+		for line, message in errors:
+			path = self.writeCsv(["Taxon,Longitude,Latitude", "Sp_0,1,2", "Sp_1,2,3", line, "Sp_1,1,-91"])
+			try:
+				with self.assertRaises(IOError) as err:
+					infile.InputData(path, chunkSize = 2)
+				self.assertTrue(str(err.exception) == message.format(path), "Wrong error for line `{0}`: {1}".format(line, err.exception))
+			finally:
+				os.remove(path)
+
+	def testRasterization(self):
+		path = self.writeCsv(["Taxon,Longitude,Latitude", "Sp_0,0.5,3.5", "Sp_0,1.5,3.5", "Sp_0,0.0,0.0", "Sp_1,3.0,1.5", "Sp_1,3.0,1.5", "Sp_1,2.2,4.0"])
+		try:
+			indata = infile.InputData(path)
+		finally:
+			os.remove(path)
+		tiles = indata.getTiles(cellSize = 1.0, sparse = False)
+		self.assertTrue(indata.presenceCube is None, "Presence cube was built for dense tiles.")
+		self.assertTrue(indata.cube.shape == (2, 4, 3) and (indata.rows, indata.cols) == (4, 3), "Wrong grid dimensions.")
+		self.assertTrue(tiles[0].toList() == [[1, 1, 0], [0, 0, 0], [0, 0, 0], [1, 0, 0]] and tiles[1].toList() == [[0, 0, 1], [0, 0, 0], [0, 0, 1], [0, 0, 0]], "Points were not assigned to their cells.")
+		self.assertTrue(all([numpy.array_equal(numpy.array(ti.toList()), indata.cube[ix]) for ix, ti in enumerate(tiles)]), "Tiles do not match the presence cube.")
+		tiles = indata.getTiles(cellSize = 1.0, geometry = "hexagon")
+		self.assertTrue(indata.cube.shape == (2, indata.rows, indata.cols) and all([numpy.array_equal(numpy.array(ti.toList()), indata.cube[ix]) for ix, ti in enumerate(tiles)]), "Hexagonal tiles do not match the presence cube.")
+		cube = indata.cube
+		sparse = indata.getTiles(cellSize = 1.0, geometry = "hexagon", sparse = True)
+		self.assertTrue(all([ti.sparse and ti.toList() == tiles[ix].toList() for ix, ti in enumerate(sparse)]), "Sparse tiles do not match dense ones.")
+		self.assertTrue(indata.presenceCube is None and numpy.array_equal(indata.cube, cube), "Presence cube was not built on demand.")
+		narrow = indata.getTiles(cellSize = 1.0, geometry = "hexagon", narrow = True, sparse = False)
+		self.assertTrue(all([ti.narrow and numpy.shares_memory(numpy.asarray(ti), indata.cube[ix]) for ix, ti in enumerate(narrow)]) and not indata.cube.flags.writeable, "Narrow tiles are not read-only views of the presence cube.")
+
+	def testHexcodes(self):
+		path = self.writeCsv(["Taxon,Longitude,Latitude", "Sp_0,-3.0,-2.0", "Sp_1,4.0,5.0"])
+		try:
+			indata = infile.InputData(path)
+		finally:
+			os.remove(path)
+		indata.getTiles(cellSize = 0.7, geometry = "hexagon", offsetLat = 0.2, offsetLon = 0.1)
+		rng = numpy.random.RandomState(3)
+		lons = rng.uniform(-4.0, 5.0, 2000)
+		lats = rng.uniform(-3.0, 6.0, 2000)
+		for DAref in (-2, 0, 5):
+			rows, cols = indata.hexcodes(lons, lats, DAref)
+			expected = [indata.hexcode(lo, la, DAref) for lo, la in zip(lons, lats)]
+			self.assertTrue(zip(rows.tolist(), cols.tolist()) == expected, "Vectorized hexagonal indexes differ from scalar ones.")
+
 
 if __name__ == "__main__":
 	unittest.main()
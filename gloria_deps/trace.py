@@ -0,0 +1,147 @@
+###############################################################################
+#
+#	Copyright 2016-2017 Nelson R. Salinas
+#
+#
+#	This file is part of Gloria.
+#
+#   Gloria is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+#	Gloria is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with Gloria.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+# Phase-level tracing. Spans are stored as complete events of the Chrome
+# trace-event format, so files written by `write` can be opened in
+# chrome://tracing or Perfetto. Tracing is off unless `start` is called; while
+# off, `span` returns a shared object that does nothing, and callers guard
+# per-call bookkeeping with the module attribute `enabled`.
+
+import json
+import os
+import time
+
+enabled = False
+origin = 0.0
+events = []
+totals = {} # name: [seconds, calls], for phases too frequent to be stored as spans
+
+class Span(object):
+	"""
+	Context manager recording a complete ("X") event from entering to exiting
+	the `with` block. Arguments shown by the trace viewer can be added with
+	`set` before exiting.
+	"""
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+		self.begin = None
+		return None
+
+	def __enter__(self):
+		self.begin = time.time()
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		end = time.time()
+		events.append({"name": self.name, "ph": "X", "pid": os.getpid(), "tid": 0,
+			"ts": (self.begin - origin) * 1e6, "dur": (end - self.begin) * 1e6, "args": self.args})
+		return False
+
+	def set(self, **args):
+		self.args.update(args)
+		return None
+
+class NullSpan(object):
+	"""
+	Span returned while tracing is disabled.
+	"""
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		return False
+
+	def set(self, **args):
+		return None
+
+nullSpan = NullSpan()
+
+def start():
+	"""
+	Enables tracing and discards previously recorded events.
+	"""
+	global enabled, origin, events, totals
+	enabled = True
+	origin = time.time()
+	events = []
+	totals = {}
+	return None
+
+def stop():
+	global enabled
+	enabled = False
+	return None
+
+def span(name, **args):
+	"""
+	Returns a context manager recording the execution of its block as a span
+	called `name`, with keyword arguments as span arguments.
+	"""
+	if enabled:
+		return Span(name, args)
+	return nullSpan
+
+def accumulate(name, seconds, calls = 1):
+	"""
+	Adds `seconds` and `calls` to the total of phase `name`.
+	"""
+	if name in totals:
+		totals[name][0] += seconds
+		totals[name][1] += calls
+	else:
+		totals[name] = [seconds, calls]
+	return None
+
+def merge(other):
+	"""
+	Adds a dictionary of totals (for instance, recorded by another process) to
+	the totals of this process.
+	"""
+	for name in other:
+		accumulate(name, other[name][0], other[name][1])
+	return None
+
+def traceEvents():
+	"""
+	Returns the list of trace events. Totals are placed as consecutive spans on
+	a separate thread of the trace, starting at time zero.
+	"""
+	pid = os.getpid()
+	out = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "Phases"}},
+		{"name": "thread_name", "ph": "M", "pid": pid, "tid": 1, "args": {"name": "Totals"}}]
+	out += events
+	ts = 0.0
+	for name in sorted(totals):
+		seconds, calls = totals[name]
+		out.append({"name": name, "ph": "X", "pid": pid, "tid": 1, "ts": ts,
+			"dur": seconds * 1e6, "args": {"calls": calls, "seconds": seconds}})
+		ts += seconds * 1e6
+	return out
+
+def write(path):
+	"""
+	Writes recorded events in trace-event JSON format to file `path`.
+	"""
+	with open(path, "w") as fh:
+		json.dump({"traceEvents": traceEvents(), "displayTimeUnit": "ms"}, fh)
+	return None
@@ -21,9 +21,18 @@
 ###############################################################################
 
 
+import os
 from setuptools import setup, find_packages
 from distutils.core import Extension
 
+# Parallel label updates of HMRF.emea (argument `threads`) use OpenMP, which is
+# enabled by building with the environment variable GLORIA_OPENMP=1 (requires a
+# compiler supporting -fopenmp).
+if os.environ.get('GLORIA_OPENMP') == '1':
+	ompArgs = ['-fopenmp']
+else:
+	ompArgs = []
+
 setup(name = 'Gloria',
 	version = '0.3',
 	author = 'Nelson R. Salinas',
@@ -35,7 +44,7 @@ setup(name = 'Gloria',
 	#install_requires = ['pyshp'],
 	test_suite = 'nose.collector',
 	tests_require = ['nose'],
-	ext_modules = [Extension('gloria_deps.data', ['gloria_deps/data.c'])],
+	ext_modules = [Extension('gloria_deps.data', ['gloria_deps/data.c'], extra_compile_args = ompArgs, extra_link_args = ompArgs)],
 	scripts = ['gloria.py'],
-	packages = ['gloria_deps','gloria_deps.gui','gloria_deps.examples','gloria_deps.test']
+	packages = ['gloria_deps','gloria_deps.bench','gloria_deps.gui','gloria_deps.examples','gloria_deps.test']
 	)